@@ -0,0 +1,163 @@
+"""
+alert_backtest.py
+Backtest a proposed threshold table and rule set against stored history. Threshold
+checks and windowed rules are evaluated vectorized over every city at once, and the
+resulting alerts are grouped into episodes to report counts, durations and overlaps
+per city (in seconds).
+"""
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from alert_system import ClimateAlertSystem, THRESHOLDS_PATH
+from alert_rules import RuleEngine, load_rules, RULES_PATH
+
+HISTORY_PATH = "data/combined_climate.csv"
+
+SUMMARY_COLUMNS = ['alerts', 'episodes', 'alert_seconds', 'mean_episode_seconds',
+                   'max_episode_seconds', 'overlap_seconds']
+
+
+def load_history(path=HISTORY_PATH, start=None, end=None, cities=None):
+    """Stored readings, optionally limited to a time range and a set of cities"""
+    df = pd.read_csv(path, parse_dates=['timestamp'])
+    if start is not None:
+        df = df[df['timestamp'] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df['timestamp'] < pd.Timestamp(end)]
+    if cities:
+        df = df[df['city'].isin(cities)]
+    return df.reset_index(drop=True)
+
+
+def backtest_alerts(df, thresholds_path=THRESHOLDS_PATH, rules_path=RULES_PATH):
+    """
+    Every alert the given configuration would have raised over df, as one frame with a
+    `source` column: the rule name, or metric_type for plain threshold alerts
+    """
+    alerts = ClimateAlertSystem(thresholds_path).check_thresholds_frame(df)
+    alerts = alerts.assign(source=alerts['metric'].astype(str) + '_' + alerts['type'].astype(str))
+    rule_alerts = RuleEngine(load_rules(rules_path)).evaluate_frame(df)
+    rule_alerts = rule_alerts.drop(columns='rule').assign(source=rule_alerts['rule'])
+    frames = [frame.astype({'metric': str, 'type': str, 'severity': str})
+              for frame in (alerts, rule_alerts) if not frame.empty]
+    if not frames:
+        return alerts.iloc[0:0]
+    return pd.concat(frames)
+
+
+def alert_episodes(alerts, df):
+    """
+    Group alerts into episodes: runs of consecutive city readings in alert for the same
+    source. An episode lasts until the city's next reading after its last alert (or its
+    last alert, at the end of the history).
+    """
+    columns = ['city', 'source', 'start', 'end', 'readings', 'duration_seconds']
+    if alerts.empty:
+        return pd.DataFrame(columns=columns)
+
+    ordered = df.sort_values(['city', 'timestamp'], kind='stable')
+    ordinal = pd.Series(np.arange(len(ordered)), index=ordered.index)
+    next_reading = ordered.groupby('city', observed=True)['timestamp'].shift(-1)
+    next_reading = next_reading.fillna(ordered['timestamp'])
+
+    rows = pd.DataFrame({
+        'city': alerts['city'].astype(str).to_numpy(),
+        'source': alerts['source'].to_numpy(),
+        'ordinal': ordinal.loc[alerts.index].to_numpy(),
+        'timestamp': ordered['timestamp'].loc[alerts.index].to_numpy(),
+        'until': next_reading.loc[alerts.index].to_numpy(),
+    }).sort_values(['city', 'source', 'ordinal'], kind='stable')
+
+    same_key = ((rows['city'] == rows['city'].shift()) &
+                (rows['source'] == rows['source'].shift()))
+    consecutive = same_key & (rows['ordinal'] - rows['ordinal'].shift() == 1)
+    episode_id = (~consecutive).cumsum()
+    episodes = rows.groupby(episode_id).agg(
+        city=('city', 'first'), source=('source', 'first'),
+        start=('timestamp', 'first'), end=('until', 'last'), readings=('ordinal', 'size'))
+    episodes['duration_seconds'] = (episodes['end'] - episodes['start']).dt.total_seconds()
+    return episodes.reset_index(drop=True)[columns]
+
+
+def overlap_seconds(episodes):
+    """Seconds per city during which two or more episodes were open at once"""
+    overlaps = {}
+    for city, group in episodes.groupby('city'):
+        times = np.concatenate([group['start'].to_numpy(), group['end'].to_numpy()])
+        deltas = np.concatenate([np.ones(len(group), dtype=int), -np.ones(len(group), dtype=int)])
+        # Closing events sort before openings at the same instant
+        order = np.lexsort((deltas, times))
+        times, active = times[order], np.cumsum(deltas[order])
+        spans = np.diff(times) / np.timedelta64(1, 's')
+        overlaps[city] = float(spans[active[:-1] >= 2].sum())
+    return pd.Series(overlaps, name='overlap_seconds', dtype=float)
+
+
+def summarize_backtest(alerts, episodes):
+    """Per-city alert counts, episode durations and overlap, all durations in seconds"""
+    if alerts.empty:
+        return pd.DataFrame(columns=SUMMARY_COLUMNS)
+    summary = pd.DataFrame({'alerts': alerts.groupby(alerts['city'].astype(str)).size()})
+    durations = episodes.groupby('city')['duration_seconds']
+    summary['episodes'] = durations.size()
+    summary['alert_seconds'] = durations.sum()
+    summary['mean_episode_seconds'] = durations.mean()
+    summary['max_episode_seconds'] = durations.max()
+    summary['overlap_seconds'] = overlap_seconds(episodes)
+    summary.index.name = 'city'
+    return summary.fillna(0).round(1)[SUMMARY_COLUMNS]
+
+
+def run_backtest(df, thresholds_path=THRESHOLDS_PATH, rules_path=RULES_PATH):
+    """(summary, per-source breakdown, episodes) for one configuration"""
+    alerts = backtest_alerts(df, thresholds_path, rules_path)
+    episodes = alert_episodes(alerts, df)
+    summary = summarize_backtest(alerts, episodes)
+    by_source = episodes.groupby(['city', 'source']).agg(
+        episodes=('duration_seconds', 'size'),
+        readings=('readings', 'sum'),
+        alert_seconds=('duration_seconds', 'sum'),
+        max_episode_seconds=('duration_seconds', 'max'))
+    return summary, by_source, episodes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtest alert thresholds and rules over stored history")
+    parser.add_argument("--data", default=HISTORY_PATH)
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH, help="proposed city,metric,high,low CSV")
+    parser.add_argument("--rules", default=RULES_PATH, help="proposed rules JSON")
+    parser.add_argument("--start")
+    parser.add_argument("--end")
+    parser.add_argument("--cities", nargs="*")
+    parser.add_argument("--by-source", action="store_true", help="also break results down per rule/metric")
+    parser.add_argument("--compare", action="store_true",
+                        help="show the change against the current thresholds and rules")
+    parser.add_argument("--output", help="write the episode list to this CSV")
+    args = parser.parse_args()
+
+    df = load_history(args.data, args.start, args.end, args.cities)
+    start = time.perf_counter()
+    summary, by_source, episodes = run_backtest(df, args.thresholds, args.rules)
+    elapsed = time.perf_counter() - start
+    print(f"Backtested {len(df):,} readings across {df['city'].nunique()} cities "
+          f"in {elapsed:.2f}s")
+    print(summary.to_string())
+
+    if args.by_source:
+        print()
+        print(by_source.to_string())
+
+    if args.compare:
+        current, _, _ = run_backtest(df)
+        change = summary.subtract(current, fill_value=0)[['alerts', 'episodes', 'alert_seconds']]
+        print("\nChange against current configuration:")
+        print(change.to_string())
+
+    if args.output:
+        episodes.to_csv(args.output, index=False)
+        print(f"Wrote {len(episodes)} episodes to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+alert_rules.py
+Streaming complex-event alert rules. Each city/metric keeps a fixed-size ring buffer
+of recent readings, and windowed rules (sustained exceedance, rate of change, rolling
+mean) are evaluated incrementally in O(1) per new reading. Rules are declared in
+data/alert_rules.json with windows as durations ("6h"; bare numbers are hours), which
+are converted to a number of readings using the reading interval. A gap in a city's
+readings longer than the interval restarts its windows.
+"""
+import os
+import json
+import math
+import logging
+import operator
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+RULES_PATH = "data/alert_rules.json"
+
+# Spacing of the readings the rules see; matches the 3-hourly ingest job
+READING_INTERVAL = timedelta(hours=float(os.getenv('READING_INTERVAL_HOURS', 3)))
+# A gap longer than this many intervals breaks a window
+GAP_TOLERANCE = 1.5
+
+logger = logging.getLogger(__name__)
+
+OPERATORS = {'>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le}
+RULE_TYPES = ('sustained', 'rate_of_change', 'rolling_mean')
+
+
+class RingBuffer:
+    """Fixed-capacity buffer of floats with O(1) push, lookback and running mean"""
+
+    def __init__(self, capacity):
+        self.values = np.full(capacity, np.nan)
+        self.capacity = capacity
+        self.head = 0   # index of the next write
+        self.count = 0
+        self._sums = {}  # window -> running sum of the last `window` values
+
+    def push(self, value):
+        for window in self._sums:
+            self._sums[window] += value
+            if self.count >= window:
+                self._sums[window] -= self.ago(window - 1)
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def ago(self, steps):
+        """Value pushed `steps` readings before the latest (0 = latest)"""
+        if steps >= self.count:
+            return None
+        return self.values[(self.head - 1 - steps) % self.capacity]
+
+    def track_mean(self, window):
+        self._sums.setdefault(window, 0.0)
+
+    def mean(self, window):
+        if self.count < window:
+            return None
+        return self._sums[window] / window
+
+
+class Rule:
+    """One declared windowed rule"""
+
+    def __init__(self, name, type, metric, window, threshold=None, op='>', delta=None,
+                 severity='HIGH', cities=None):
+        if type not in RULE_TYPES:
+            raise ValueError(f"Unknown rule type '{type}' for rule {name}")
+        self.name = name
+        self.type = type
+        self.metric = metric
+        self.window = pd.Timedelta(window, unit='h') if isinstance(window, (int, float)) \
+            else pd.Timedelta(window)
+        if self.window <= pd.Timedelta(0):
+            raise ValueError(f"Rule {name} needs a positive window, got {window}")
+        self.threshold = threshold
+        self.op = op
+        self.compare = OPERATORS[op]
+        self.delta = delta
+        self.severity = severity
+        self.cities = set(cities) if cities else None
+
+    @property
+    def direction(self):
+        if self.type == 'rate_of_change':
+            return 'high' if self.delta >= 0 else 'low'
+        return 'high' if self.op.startswith('>') else 'low'
+
+    def applies_to(self, city):
+        return self.cities is None or city in self.cities
+
+    def steps(self, interval):
+        """
+        Readings the window spans at this interval: the streak length for sustained and
+        rolling-mean rules, the lookback for rate-of-change rules
+        """
+        return max(1, math.ceil(self.window / pd.Timedelta(interval) - 1e-9))
+
+
+def load_rules(path=RULES_PATH):
+    """Read rule declarations from a JSON list"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [Rule(**spec) for spec in json.load(f)]
+
+
+class RuleEngine:
+    """Incremental evaluator for windowed rules over per-city/metric ring buffers"""
+
+    def __init__(self, rules=None, interval=READING_INTERVAL):
+        self.rules = load_rules() if rules is None else rules
+        self.interval = pd.Timedelta(interval)
+        self.buffers = {}
+        self.streaks = {}
+        self.last_seen = {}  # city -> timestamp of the latest reading pushed
+        self._steps = {rule.name: rule.steps(self.interval) for rule in self.rules}
+        self._rules_by_metric = {}
+        for rule in self.rules:
+            self._rules_by_metric.setdefault(rule.metric, []).append(rule)
+        # Each buffer must reach back as far as the longest window on its metric
+        self._capacity = {metric: max(self._steps[r.name] for r in rules) + 1
+                          for metric, rules in self._rules_by_metric.items()}
+
+    def _buffer(self, city, metric):
+        key = (city, metric)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = self.buffers[key] = RingBuffer(self._capacity[metric])
+            for rule in self._rules_by_metric[metric]:
+                if rule.type == 'rolling_mean':
+                    buffer.track_mean(self._steps[rule.name])
+        return buffer
+
+    def _reset_city(self, city):
+        """Forget a city's buffers and streaks so no window spans a gap in its readings"""
+        for key in [key for key in self.buffers if key[0] == city]:
+            del self.buffers[key]
+        for key in [key for key in self.streaks if key[0] == city]:
+            del self.streaks[key]
+
+    def check_interval(self, df):
+        """Warn when the readings in df are not spaced at the interval the windows assume"""
+        spacing = df.sort_values(['city', 'timestamp'], kind='stable') \
+            .groupby('city')['timestamp'].diff().median()
+        if pd.notna(spacing) and abs(spacing - self.interval) > self.interval * 0.1:
+            logger.warning(f"Readings are {spacing} apart but rule windows assume {self.interval}; "
+                           f"set READING_INTERVAL_HOURS to match")
+        return spacing
+
+    @property
+    def max_window(self):
+        """Readings of history needed to fill every buffer"""
+        return max(self._capacity.values(), default=0)
+
+    def prime(self, df):
+        """Fill the buffers from recent history without raising alerts"""
+        if self.rules and not df.empty:
+            self.replay(df.groupby('city').tail(self.max_window))
+
+    def evaluated_rules(self, city, readings):
+        """Names of the rules update() evaluates for these readings"""
+        present = [metric for metric in self._rules_by_metric
+                   if readings.get(metric) is not None and readings[metric] == readings[metric]]
+        return {rule.name for metric in present for rule in self._rules_by_metric[metric]
+                if rule.applies_to(city)}
+
+    def update(self, city, readings, timestamp=None):
+        """Push one reading per metric for a city and return the rule alerts it triggers"""
+        timestamp = timestamp or datetime.now()
+        previous = self.last_seen.get(city)
+        if previous is not None and timestamp - previous > self.interval * GAP_TOLERANCE:
+            self._reset_city(city)
+        self.last_seen[city] = timestamp
+        alerts = []
+        for metric, rules in self._rules_by_metric.items():
+            value = readings.get(metric)
+            if value is None or value != value:
+                continue
+            buffer = self._buffer(city, metric)
+            buffer.push(float(value))
+            for rule in rules:
+                if rule.applies_to(city):
+                    alert = self._evaluate(rule, city, buffer, float(value), timestamp)
+                    if alert:
+                        alerts.append(alert)
+        return alerts
+
+    def _evaluate(self, rule, city, buffer, value, timestamp):
+        if rule.type == 'sustained':
+            key = (city, rule.name)
+            streak = self.streaks.get(key, 0) + 1 if rule.compare(value, rule.threshold) else 0
+            self.streaks[key] = streak
+            if streak < self._steps[rule.name]:
+                return None
+            observed, threshold = value, rule.threshold
+        elif rule.type == 'rate_of_change':
+            past = buffer.ago(self._steps[rule.name])
+            if past is None:
+                return None
+            change = value - past
+            if not (change >= rule.delta if rule.delta >= 0 else change <= rule.delta):
+                return None
+            observed, threshold = round(float(change), 2), rule.delta
+        else:
+            mean = buffer.mean(self._steps[rule.name])
+            if mean is None or not rule.compare(mean, rule.threshold):
+                return None
+            observed, threshold = round(float(mean), 2), rule.threshold
+
+        return {
+            'metric': rule.metric,
+            'value': observed,
+            'threshold': threshold,
+            'type': rule.direction,
+            'severity': rule.severity,
+            'timestamp': timestamp,
+            'city': city,
+            'rule': rule.name,
+        }
+
+    def replay(self, df):
+        """Feed a history frame (timestamp, city, metric columns) row by row in time order"""
+        alerts = []
+        metrics = [metric for metric in self._rules_by_metric if metric in df]
+        self.check_interval(df)
+        # Stable, so readings sharing a timestamp keep their file order
+        for row in df.sort_values('timestamp', kind='mergesort').itertuples(index=False):
+            readings = {metric: getattr(row, metric) for metric in metrics}
+            alerts.extend(self.update(row.city, readings, row.timestamp))
+        return alerts
+
+    def evaluate_frame(self, df):
+        """
+        Vectorized equivalent of replay(): every rule over a whole history frame at once,
+        returned as an alerts frame indexed like df. Does not touch the streaming state.
+        """
+        columns = ['timestamp', 'city', 'metric', 'value', 'threshold', 'type', 'severity', 'rule']
+        self.check_interval(df)
+        ordered = df.sort_values(['city', 'timestamp'], kind='stable')
+        frames = []
+        for metric, rules in self._rules_by_metric.items():
+            if metric not in ordered:
+                continue
+            # Missing readings are skipped, as in update()
+            series = ordered[ordered[metric].notna()]
+            values = series[metric].to_numpy(dtype=float)
+            cities = series['city'].astype(object).to_numpy()
+            n = len(values)
+            if not n:
+                continue
+            rows = np.arange(n)
+            # Windows restart at each city and, as in update(), after a gap in the readings
+            times = pd.to_datetime(series['timestamp']).to_numpy()
+            gaps = np.diff(times) > np.timedelta64(self.interval * GAP_TOLERANCE)
+            boundary = np.r_[True, (cities[1:] != cities[:-1]) | gaps]
+            position = rows - np.maximum.accumulate(np.where(boundary, rows, 0))
+
+            for rule in rules:
+                window = self._steps[rule.name]
+                if rule.type == 'sustained':
+                    hit = rule.compare(values, rule.threshold)
+                    # Length of the run of hits ending at each reading, restarting per city
+                    resets = np.where(~hit, rows, np.where(boundary, rows - 1, -1))
+                    streak = rows - np.maximum.accumulate(resets)
+                    fired = hit & (streak >= window)
+                    observed = values
+                elif rule.type == 'rate_of_change':
+                    change = np.full(n, np.nan)
+                    change[window:] = values[window:] - values[:-window]
+                    change[position < window] = np.nan
+                    with np.errstate(invalid='ignore'):
+                        fired = change >= rule.delta if rule.delta >= 0 else change <= rule.delta
+                    observed = np.round(change, 2)
+                else:
+                    sums = np.cumsum(np.r_[0.0, values])
+                    mean = np.full(n, np.nan)
+                    mean[window - 1:] = (sums[window:] - sums[:-window]) / window
+                    mean[position < window - 1] = np.nan
+                    with np.errstate(invalid='ignore'):
+                        fired = rule.compare(mean, rule.threshold)
+                    observed = np.round(mean, 2)
+                if rule.cities is not None:
+                    fired &= np.isin(cities, list(rule.cities))
+
+                idx = np.flatnonzero(fired)
+                if not idx.size:
+                    continue
+                frames.append(pd.DataFrame({
+                    'timestamp': series['timestamp'].to_numpy()[idx],
+                    'city': cities[idx],
+                    'metric': rule.metric,
+                    'value': observed[idx],
+                    'threshold': rule.delta if rule.type == 'rate_of_change' else rule.threshold,
+                    'type': rule.direction,
+                    'severity': rule.severity,
+                    'rule': rule.name,
+                }, index=series.index[idx]))
+
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames).sort_values('timestamp', kind='stable')
+
+
+if __name__ == "__main__":
+    df = pd.read_csv("data/combined_climate.csv")
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    engine = RuleEngine()
+    alerts = engine.replay(df)
+    print(f"Replayed {len(df)} readings through {len(engine.rules)} rules: {len(alerts)} rule alerts")
+    for alert in alerts[-10:]:
+        print(f"- {alert['timestamp']} {alert['city']} {alert['rule']}: {alert['value']}")
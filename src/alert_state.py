@@ -0,0 +1,141 @@
+"""
+alert_state.py
+Stateful alert engine that tracks open alerts per (source, city, metric) so a persistent
+condition notifies once, re-notifies only after a configurable interval, and closes
+only after the value recovers past an exit hysteresis band. State is persisted to
+disk so restarts do not re-fire open alerts.
+"""
+import os
+import json
+import threading
+from datetime import datetime, timedelta
+
+ALERT_STATE_PATH = "data/alert_state.json"
+
+# How far back inside the threshold a value must return before an alert closes
+DEFAULT_HYSTERESIS = {
+    'temperature': 1.0,  # Celsius
+    'aqi': 10,           # AQI index
+    'rainfall': 5,       # mm
+    'humidity': 2,       # percentage
+}
+DEFAULT_RENOTIFY_INTERVAL = timedelta(hours=6)
+
+# Where an alert was raised; forecast and real-time alerts on the same metric are tracked apart
+SOURCES = ('forecast', 'realtime')
+
+
+class AlertStateEngine:
+    """Deduplicates alerts per (source, city, metric, direction) with hysteresis and re-notify windows"""
+
+    def __init__(self, path=ALERT_STATE_PATH, hysteresis=None,
+                 renotify_interval=DEFAULT_RENOTIFY_INTERVAL):
+        self.path = path
+        self.hysteresis = {**DEFAULT_HYSTERESIS, **(hysteresis or {})}
+        self.renotify_interval = renotify_interval
+        self.open_alerts = {}
+        self.suppressed = 0
+        self._lock = threading.Lock()
+        self._load()
+
+    @staticmethod
+    def _key(city, alert, source):
+        # Rule alerts are tracked separately from plain threshold alerts on the same metric
+        kind = alert.get('rule') or alert['type']
+        return f"{source}|{city or '*'}|{alert['metric']}|{kind}"
+
+    def _load(self):
+        if self.path and os.path.exists(self.path):
+            with open(self.path) as f:
+                self.open_alerts = json.load(f)
+            # State saved before alerts carried a source came from the forecast checks
+            for key in [key for key in self.open_alerts if key.split('|', 1)[0] not in SOURCES]:
+                state = self.open_alerts.pop(key)
+                state['source'] = 'forecast'
+                self.open_alerts[f"forecast|{key}"] = state
+
+    def save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.open_alerts, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def _recovered(self, state, value):
+        band = self.hysteresis.get(state['metric'], 0)
+        if state['type'] == 'high':
+            return value < state['threshold'] - band
+        return value > state['threshold'] + band
+
+    def filter_alerts(self, city, readings, alerts, now=None, rules=(), source='realtime'):
+        """
+        Update open-alert state from one set of readings and the alerts they raised.
+        `source` ('forecast' or 'realtime') says where they came from; only open alerts
+        of the same source can close. `rules` names the windowed rules evaluated for
+        these readings; open rule alerts of other rules are left as they are. Returns
+        the alerts to notify now.
+        """
+        if source not in SOURCES:
+            raise ValueError(f"Unknown alert source '{source}'; expected one of {SOURCES}")
+        now = now or datetime.now()
+        to_notify = []
+        with self._lock:
+            raised = set()
+            for alert in alerts:
+                key = self._key(city, alert, source)
+                raised.add(key)
+                state = self.open_alerts.get(key)
+                if state is None:
+                    self.open_alerts[key] = {
+                        'source': source,
+                        'city': city,
+                        'metric': alert['metric'],
+                        'type': alert['type'],
+                        'rule': alert.get('rule'),
+                        'threshold': float(alert['threshold']),
+                        'opened_at': now.isoformat(),
+                        'last_notified': now.isoformat(),
+                        'last_value': float(alert['value']),
+                        'notifications': 1,
+                    }
+                    to_notify.append(alert)
+                    continue
+                state['last_value'] = float(alert['value'])
+                if now - datetime.fromisoformat(state['last_notified']) >= self.renotify_interval:
+                    state['last_notified'] = now.isoformat()
+                    state['notifications'] += 1
+                    to_notify.append(alert)
+                else:
+                    self.suppressed += 1
+
+            # Open alerts that did not fire this time close once the value clears the band;
+            # values inside the band keep them open so small oscillations do not re-fire
+            for key, state in list(self.open_alerts.items()):
+                if key in raised or state['city'] != city or state.get('source') != source:
+                    continue
+                if state.get('rule'):
+                    # Windowed rules already encode persistence; close as soon as they stop firing
+                    if state['rule'] in rules:
+                        del self.open_alerts[key]
+                    continue
+                if state['metric'] not in readings:
+                    continue
+                value = readings[state['metric']]
+                if value is None or value != value:  # missing reading, leave state unchanged
+                    continue
+                if self._recovered(state, value):
+                    del self.open_alerts[key]
+                else:
+                    state['last_value'] = float(value)
+
+            self.save()
+        return to_notify
+
+    def open_alert_summary(self):
+        """Currently open alerts as a list of state records"""
+        with self._lock:
+            return [dict(state) for state in self.open_alerts.values()]
@@ -0,0 +1,162 @@
+"""
+alert_store.py
+Append-only alert history in SQLite (WAL mode), indexed by city, metric and time,
+with a small query API for dashboards and reports.
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime
+import pandas as pd
+
+ALERT_STORE_PATH = "data/alerts.db"
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+COLUMNS = ['timestamp', 'city', 'metric', 'value', 'threshold', 'type', 'severity', 'rule']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    city TEXT,
+    metric TEXT NOT NULL,
+    value REAL,
+    threshold REAL,
+    type TEXT,
+    severity TEXT,
+    recorded_at TEXT NOT NULL,
+    rule TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_alerts_city_metric_time ON alerts (city, metric, timestamp);
+CREATE INDEX IF NOT EXISTS idx_alerts_time ON alerts (timestamp);
+"""
+
+# Columns added after the first release, applied to existing databases on open
+MIGRATIONS = {
+    'alerts': [('rule', 'TEXT')],
+}
+
+
+def _iso(value):
+    if value is None:
+        return None
+    return pd.Timestamp(value).strftime(TIMESTAMP_FORMAT)
+
+
+class AlertStore:
+    """Append-only SQLite alert log"""
+
+    def __init__(self, path=ALERT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            for table, columns in MIGRATIONS.items():
+                existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                for name, kind in columns:
+                    if name not in existing:
+                        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def append(self, alerts):
+        """
+        Append alert dicts (as produced by ClimateAlertSystem.check_thresholds); windowed
+        rule alerts keep their rule name, plain threshold alerts store NULL
+        """
+        recorded_at = datetime.now().isoformat(sep=' ')
+        rows = [(_iso(a['timestamp']), a.get('city'), a['metric'], float(a['value']),
+                 float(a['threshold']), a['type'], a['severity'], recorded_at, a.get('rule'))
+                for a in alerts]
+        return self._insert(rows)
+
+    def append_frame(self, alerts):
+        """Append an alerts frame (as produced by ClimateAlertSystem.check_thresholds_frame)"""
+        if alerts.empty:
+            return 0
+        frame = pd.DataFrame({
+            'timestamp': pd.to_datetime(alerts['timestamp']).dt.strftime(TIMESTAMP_FORMAT),
+            'city': alerts['city'].astype(object) if 'city' in alerts else None,
+            'metric': alerts['metric'].astype(str),
+            'value': alerts['value'].astype(float),
+            'threshold': alerts['threshold'].astype(float),
+            'type': alerts['type'].astype(str),
+            'severity': alerts['severity'].astype(str),
+        })
+        frame['recorded_at'] = datetime.now().isoformat(sep=' ')
+        if 'rule' in alerts:
+            rule = alerts['rule'].astype(object)
+            frame['rule'] = rule.where(rule.notna(), None)
+        else:
+            frame['rule'] = None
+        return self._insert(frame.itertuples(index=False, name=None))
+
+    def _insert(self, rows):
+        with self._lock, self._conn:
+            cursor = self._conn.executemany(
+                "INSERT INTO alerts (timestamp, city, metric, value, threshold, type, severity, recorded_at, rule) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            return cursor.rowcount
+
+    def query(self, city=None, metric=None, start=None, end=None, severity=None, rule=None,
+              limit=None):
+        """Alerts matching the filters, oldest first; start/end bound the alert timestamp"""
+        clauses, params = [], []
+        for column, value in (('city', city), ('metric', metric), ('severity', severity),
+                              ('rule', rule)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(_iso(start))
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(_iso(end))
+        sql = f"SELECT {', '.join(COLUMNS)} FROM alerts"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY timestamp"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+        with self._lock:
+            df = pd.read_sql_query(sql, self._conn, params=params)
+        df['timestamp'] = pd.to_datetime(df['timestamp'], format='ISO8601')
+        return df
+
+    def counts(self, start=None, end=None):
+        """Alert counts per city, metric and severity"""
+        df = self.query(start=start, end=end)
+        return df.groupby(['city', 'metric', 'severity'], dropna=False).size().rename('alerts').reset_index()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_alert_store():
+    """Process-wide store; one WAL connection shared by every thread that saves alerts"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = AlertStore()
+        return _default_store
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = AlertStore()
+    city = sys.argv[1] if len(sys.argv) > 1 else None
+    print(store.query(city=city).tail(20))
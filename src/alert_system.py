@@ -3,13 +3,24 @@ alert_system.py
 Sends email and SMS alerts when climate risk thresholds are exceeded.
 """
 import os
-import smtplib
+import time
+import logging
+import threading
+import numpy as np
 import pandas as pd
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
 from dotenv import load_dotenv
-from twilio.rest import Client
+from email_channel import get_mailer, close_mailer, digest_alert
+from sms_channel import get_sms_channel
+from webhook_channel import get_webhook_channel, close_webhook_channel, WEBHOOK_URL
+from dispatch_queue import NotificationDispatcher, RECIPIENT_STATE_PATH
+from alert_state import AlertStateEngine
+from alert_rules import RuleEngine
+from alert_store import get_alert_store
+from subscriptions import get_subscription_store
+from structured_logging import setup_logging
+import metrics
 import joblib
+from scipy.special import ndtr
 from datetime import datetime
 
 # Load environment variables
@@ -20,22 +31,248 @@ TWILIO_SID = os.getenv('TWILIO_SID')
 TWILIO_TOKEN = os.getenv('TWILIO_TOKEN')
 TWILIO_PHONE = os.getenv('TWILIO_PHONE')
 
+DEFAULT_THRESHOLDS = {
+    'temperature': {'high': 40, 'low': 0},  # Celsius
+    'aqi': {'high': 200, 'low': 0},         # AQI index
+    'rainfall': {'high': 50, 'low': 0},     # mm
+    'humidity': {'high': 95, 'low': 10}     # percentage
+}
+THRESHOLDS_PATH = "data/alert_thresholds.csv"
+FORECAST_METRICS = ['temperature', 'humidity', 'rainfall', 'aqi']
+REALTIME_PATH = "data/processed_climate.csv"
+HISTORY_PATH = "data/combined_climate.csv"
+FORECAST_INTERVAL_Z = 1.2816  # half-width of Prophet's default 80% interval in standard deviations
+
+logger = logging.getLogger(__name__)
+
+ALERTS_DETECTED = metrics.counter('climate_alerts_detected_total', "Alerts raised by checks",
+                                  ['city', 'metric', 'severity'])
+ALERTS_NOTIFIED = metrics.counter('climate_alerts_notified_total', "Alerts handed to delivery",
+                                  ['city', 'severity'])
+DELIVERIES = metrics.counter('climate_alert_deliveries_total', "Notification delivery attempts",
+                             ['channel', 'outcome'])
+DELIVERY_SECONDS = metrics.histogram('climate_alert_delivery_duration_seconds',
+                                     "Time to deliver one notification", ['channel'])
+FORECAST_CHECK_SECONDS = metrics.histogram('climate_forecast_check_duration_seconds',
+                                           "Forecast alert check time per call")
+
+
+class ThresholdTable:
+    """
+    Per-city, per-metric alert limits compiled into arrays.
+    Row i of `high`/`low` holds the limits for `cities[i]`; the final row holds the
+    defaults used for any city without overrides.
+    """
+
+    def __init__(self, defaults=None, overrides=None):
+        defaults = defaults or DEFAULT_THRESHOLDS
+        overrides = overrides or {}
+        for metric, limits in defaults.items():
+            if 'high' not in limits or 'low' not in limits:
+                raise ValueError(f"Default thresholds for '{metric}' need both high and low")
+        for city, limits in overrides.items():
+            unknown = sorted(set(limits) - set(defaults))
+            if unknown:
+                raise ValueError(f"Thresholds for {city} name unknown metric(s) {unknown}; "
+                                 f"known metrics are {list(defaults)}")
+        self.metrics = list(defaults)
+        self.cities = sorted(overrides)
+        self.defaults = {metric: dict(limits) for metric, limits in defaults.items()}
+        self.default_row = len(self.cities)
+
+        shape = (len(self.cities) + 1, len(self.metrics))
+        self.high = np.empty(shape)
+        self.low = np.empty(shape)
+        for j, metric in enumerate(self.metrics):
+            self.high[:, j] = defaults[metric]['high']
+            self.low[:, j] = defaults[metric]['low']
+        for i, city in enumerate(self.cities):
+            for metric, limits in overrides[city].items():
+                j = self.metrics.index(metric)
+                self.high[i, j] = limits.get('high', self.high[i, j])
+                self.low[i, j] = limits.get('low', self.low[i, j])
+
+    @classmethod
+    def from_csv(cls, path=THRESHOLDS_PATH):
+        """
+        Load a city,metric,high,low table; city '*' rows override the built-in defaults.
+        Rows for metrics without built-in defaults are logged and skipped.
+        """
+        defaults = {metric: dict(limits) for metric, limits in DEFAULT_THRESHOLDS.items()}
+        overrides = {}
+        if not os.path.exists(path):
+            return cls(defaults)
+        table = pd.read_csv(path)
+        missing = {'city', 'metric'} - set(table.columns)
+        if missing:
+            raise ValueError(f"{path} is missing column(s) {sorted(missing)}")
+        for row in table.to_dict('records'):
+            if row['metric'] not in defaults:
+                logger.warning(f"{path}: skipping thresholds for unknown metric '{row['metric']}' "
+                               f"(city {row['city']}); known metrics are {list(defaults)}")
+                continue
+            limits = {key: row[key] for key in ('high', 'low') if pd.notna(row.get(key))}
+            if row['city'] == '*':
+                defaults.setdefault(row['metric'], {}).update(limits)
+            else:
+                overrides.setdefault(row['city'], {}).setdefault(row['metric'], {}).update(limits)
+        return cls(defaults, overrides)
+
+    def city_codes(self, cities):
+        """Map a column of city names to row indices, unknown cities to the default row"""
+        cities = pd.Series(cities)
+        index = pd.Index(self.cities)
+        if isinstance(cities.dtype, pd.CategoricalDtype):
+            # Resolve each category once rather than every row
+            lookup = np.append(index.get_indexer(cities.cat.categories), -1)
+            codes = lookup[cities.cat.codes.to_numpy()]
+        else:
+            codes = index.get_indexer(cities)
+        return np.where(codes < 0, self.default_row, codes)
+
+    def limits(self, city=None):
+        """Limits for one city as {metric: {'high': .., 'low': ..}}"""
+        row = self.cities.index(city) if city in self.cities else self.default_row
+        return {metric: {'high': float(self.high[row, j]), 'low': float(self.low[row, j])}
+                for j, metric in enumerate(self.metrics)}
+
+
+def _count_alerts(counter, alerts, *labels):
+    for alert in alerts:
+        counter.labels(alert.get('city') or 'unknown', *(alert[label] for label in labels),
+                       alert['severity']).inc()
+
+
+def _timed_delivery(channel, send, *args):
+    """Run one delivery, recording its latency and outcome"""
+    start = time.perf_counter()
+    try:
+        send(*args)
+    except Exception:
+        DELIVERIES.labels(channel, 'failed').inc()
+        raise
+    finally:
+        DELIVERY_SECONDS.labels(channel).observe(time.perf_counter() - start)
+    DELIVERIES.labels(channel, 'delivered').inc()
+
+
+def deliver_sms(alert, recipient_phone):
+    """Send one SMS through the shared Twilio channel, raising on failure"""
+    _timed_delivery('sms', get_sms_channel().send, alert, recipient_phone)
+
+
+def deliver_email(alert, recipient_email):
+    """
+    Send one email over the pooled SMTP connection, raising on failure. With an email
+    digest window configured the alert joins the recipient's next digest instead; a
+    digest that later fails comes back through the dispatcher (see create_dispatcher).
+    """
+    mailer = get_mailer()
+    if mailer.digest_window and not alert.get('suppressed'):
+        mailer.queue_alert(alert, recipient_email)
+        DELIVERIES.labels('email', 'queued').inc()
+        return
+    _timed_delivery('email', mailer.send_alert, alert, recipient_email)
+
+
+# At most `count` notifications per recipient per `seconds` on each channel
+RECIPIENT_LIMITS = {
+    'email': (10, 3600),
+    'sms': (5, 3600),
+}
+
+# Sends per second across all recipients; SMS is limited inside the Twilio channel
+# (TWILIO_RATE) and webhook posts inside the webhook channel (WEBHOOK_RATE)
+EMAIL_RATE = float(os.getenv('EMAIL_RATE', 5))
+CHANNEL_RATES = {channel: rate for channel, rate in (('email', EMAIL_RATE),) if rate > 0}
+
+
+def drain_webhook():
+    """Post any alerts still batched for the incident webhook and wait for delivery"""
+    if WEBHOOK_URL:
+        get_webhook_channel().drain()
+
+
+def create_dispatcher(**kwargs):
+    """
+    NotificationDispatcher wired to the email and SMS channels, already started. Email
+    digests the mailer fails to send are resubmitted to it for retry and dead-lettering.
+    Recipient budgets are saved at stop, so --run-once processes share the limits.
+    """
+    senders = {'email': deliver_email, 'sms': deliver_sms}
+    kwargs.setdefault('recipient_limits', RECIPIENT_LIMITS)
+    kwargs.setdefault('channel_rates', CHANNEL_RATES)
+    kwargs.setdefault('state_path', RECIPIENT_STATE_PATH)
+    dispatcher = NotificationDispatcher(senders, **kwargs).start()
+
+    def resubmit_digest(recipient, alerts, error):
+        DELIVERIES.labels('email', 'failed').inc()
+        logger.warning(f"Email digest to {recipient} failed ({error}); handing it to the dispatcher")
+        dispatcher.submit('email', digest_alert(alerts), recipient, summary=True)
+
+    get_mailer().on_failure = resubmit_digest
+    return dispatcher
+
+
+_default_dispatcher = None
+_default_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """
+    Process-wide dispatcher shared by every alert run, so per-recipient limits and
+    held-back summaries carry over from one scheduled run to the next
+    """
+    global _default_dispatcher
+    with _default_dispatcher_lock:
+        if _default_dispatcher is None:
+            _default_dispatcher = create_dispatcher()
+        return _default_dispatcher
+
+
+def shutdown_dispatcher(timeout=300):
+    """
+    At process exit: deliver queued notifications, send pending email digests while the
+    dispatcher can still retry them, stop the dispatcher (sending pending summaries),
+    then close the mail pool and post the last webhook batch
+    """
+    global _default_dispatcher
+    with _default_dispatcher_lock:
+        dispatcher, _default_dispatcher = _default_dispatcher, None
+    if dispatcher is not None:
+        dispatcher.join(timeout)
+        try:
+            get_mailer().flush_digests(force=True)
+        except Exception as e:
+            logger.error(f"Email digest flush at shutdown failed: {e}")
+        dispatcher.stop(drain=True, timeout=timeout)
+    close_mailer()
+    close_webhook_channel()
+
 
 class ClimateAlertSystem:
-    def __init__(self):
-        self.thresholds = {
-            'temperature': {'high': 40, 'low': 0},  # Celsius
-            'aqi': {'high': 200, 'low': 0},         # AQI index
-            'rainfall': {'high': 50, 'low': 0},     # mm
-            'humidity': {'high': 95, 'low': 10}     # percentage
-        }
+    def __init__(self, thresholds_path=THRESHOLDS_PATH, dispatcher=None, state_engine=None,
+                 rule_engine=None, subscriptions=None):
+        self.threshold_table = ThresholdTable.from_csv(thresholds_path)
+        self.thresholds = self.threshold_table.defaults
         self.alert_log = []
+        self._saved_count = 0
+        # Optional NotificationDispatcher; when set, process_alerts queues deliveries
+        # instead of sending them inline
+        self.dispatcher = dispatcher
+        # Optional AlertStateEngine; when set, only new or re-notify-due alerts are sent
+        self.state_engine = state_engine
+        # Optional RuleEngine for windowed rules (sustained, rate of change, rolling mean)
+        self.rule_engine = rule_engine
+        # Optional SubscriptionStore; matching subscribers receive each alert as well
+        self.subscriptions = subscriptions
 
     def check_thresholds(self, data):
-        """Check if any values exceed defined thresholds"""
+        """Check if any values exceed the thresholds for the reading's city"""
         alerts = []
+        city = data.get('city')
         
-        for metric, values in self.thresholds.items():
+        for metric, values in self.threshold_table.limits(city).items():
             if metric in data:
                 current_value = data[metric]
                 if current_value > values['high']:
@@ -57,128 +294,371 @@ class ClimateAlertSystem:
                         'timestamp': datetime.now()
                     })
         
+        if city is not None:
+            for alert in alerts:
+                alert['city'] = city
+        
         return alerts
 
+    def check_thresholds_frame(self, df):
+        """Vectorized check_thresholds over every row of a DataFrame (all cities, timestamps, metrics)"""
+        rows, metrics, values, thresholds, types = [], [], [], [], []
+        table = self.threshold_table
+        metric_names = table.metrics
+        if 'city' in df:
+            codes = table.city_codes(df['city'])
+        else:
+            codes = np.full(len(df), table.default_row)
+
+        for code, metric in enumerate(metric_names):
+            if metric not in df:
+                continue
+            column = df[metric].to_numpy(dtype=float, na_value=np.nan)
+            high = table.high[codes, code]
+            low = table.low[codes, code]
+            for is_high, mask, limit in ((True, column > high, high), (False, column < low, low)):
+                idx = np.flatnonzero(mask)
+                if idx.size:
+                    rows.append(idx)
+                    metrics.append(np.full(idx.size, code, dtype=np.int8))
+                    values.append(column[idx])
+                    thresholds.append(limit[idx])
+                    types.append(np.full(idx.size, is_high))
+
+        keys = [column for column in ('timestamp', 'city') if column in df]
+        if not rows:
+            return pd.DataFrame(columns=keys + ['metric', 'value', 'threshold', 'type', 'severity'])
+
+        rows = np.concatenate(rows)
+        order = np.argsort(rows, kind='stable')
+        rows = rows[order]
+        is_high = np.concatenate(types)[order]
+
+        alerts = {column: df[column].to_numpy()[rows] for column in keys}
+        alerts['metric'] = pd.Categorical.from_codes(np.concatenate(metrics)[order], metric_names)
+        alerts['value'] = np.concatenate(values)[order]
+        alerts['threshold'] = np.concatenate(thresholds)[order]
+        alerts['type'] = pd.Categorical.from_codes(is_high.astype(np.int8), ['low', 'high'])
+        alerts['severity'] = pd.Categorical.from_codes(is_high.astype(np.int8), ['MEDIUM', 'HIGH'])
+        return pd.DataFrame(alerts, index=df.index[rows])
+
     def send_email_alert(self, alert, recipient_email):
-        """Send email alert for climate risk"""
+        """Send email alert for climate risk over the shared pooled SMTP connection"""
         try:
-            msg = MIMEMultipart()
-            msg['From'] = EMAIL_USER
-            msg['To'] = recipient_email
-            msg['Subject'] = f"🚨 Climate Risk Alert - {alert['severity']}"
-            
-            body = f"""
-            Climate Risk Alert
-            
-            Metric: {alert['metric'].title()}
-            Current Value: {alert['value']}
-            Threshold: {alert['threshold']} ({alert['type']})
-            Severity: {alert['severity']}
-            Time: {alert['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}
-            
-            Please take appropriate action.
-            
-            Automated Climate Risk Prediction System
-            """
-            
-            msg.attach(MIMEText(body, 'plain'))
-            
-            server = smtplib.SMTP('smtp.gmail.com', 587)
-            server.starttls()
-            server.login(EMAIL_USER, EMAIL_PASS)
-            text = msg.as_string()
-            server.sendmail(EMAIL_USER, recipient_email, text)
-            server.quit()
-            
-            print(f"Email alert sent for {alert['metric']}")
+            deliver_email(alert, recipient_email)
+            logger.info(f"Email alert sent for {alert['metric']}")
             return True
             
         except Exception as e:
-            print(f"Email alert failed: {e}")
+            logger.error(f"Email alert failed: {e}")
             return False
 
     def send_sms_alert(self, alert, recipient_phone):
-        """Send SMS alert using Twilio"""
-        try:
-            client = Client(TWILIO_SID, TWILIO_TOKEN)
-            
-            message_body = f"🚨 Climate Alert: {alert['metric'].title()} is {alert['value']} (threshold: {alert['threshold']}). Severity: {alert['severity']}"
-            
-            message = client.messages.create(
-                body=message_body,
-                from_=TWILIO_PHONE,
-                to=recipient_phone
-            )
-            
-            print(f"SMS alert sent for {alert['metric']}")
-            return True
-            
-        except Exception as e:
-            print(f"SMS alert failed: {e}")
-            return False
+        """Send SMS alert using Twilio; recipient_phone may be one number or a list"""
+        phones = [recipient_phone] if isinstance(recipient_phone, str) else list(recipient_phone)
+        results = get_sms_channel().fan_out(alert, phones)
+        failures = {phone: error for phone, error in results.items() if error is not True}
+        DELIVERIES.labels('sms', 'delivered').inc(len(phones) - len(failures))
+        DELIVERIES.labels('sms', 'failed').inc(len(failures))
+        for phone, error in failures.items():
+            logger.error(f"SMS alert to {phone} failed: {error}")
+        if len(failures) < len(phones):
+            logger.info(f"SMS alert sent for {alert['metric']} to {len(phones) - len(failures)} recipient(s)")
+        return not failures
 
     def process_alerts(self, data, email=None, phone=None):
         """Process data and send alerts if thresholds are exceeded"""
         alerts = self.check_thresholds(data)
+        evaluated = set()
+        if self.rule_engine is not None and data.get('city') is not None:
+            evaluated = self.rule_engine.evaluated_rules(data['city'], data)
+            alerts += self.rule_engine.update(data['city'], data, data.get('timestamp'))
+        to_notify = alerts
+        if self.state_engine is not None:
+            # Suppress alerts that are already open and not yet due for a reminder
+            to_notify = self.state_engine.filter_alerts(data.get('city'), data, alerts, rules=evaluated,
+                                                        source='realtime')
+        
+        # Log every detected alert, notified or not
+        self.alert_log.extend(alerts)
+        _count_alerts(ALERTS_DETECTED, alerts, 'metric')
+        self.dispatch_alerts(to_notify, email, phone)
         
+        return alerts
+
+    def _recipients(self, alert, email=None, phone=None):
+        """Explicit recipients plus any matching subscribers, de-duplicated"""
+        emails = [email] if isinstance(email, str) else list(email or [])
+        phones = [phone] if isinstance(phone, str) else list(phone or [])
+        if self.subscriptions is not None:
+            subscriber_emails, subscriber_phones = self.subscriptions.recipients(alert)
+            emails += subscriber_emails
+            phones += subscriber_phones
+        return list(dict.fromkeys(emails)), list(dict.fromkeys(phones))
+
+    def dispatch_alerts(self, alerts, email=None, phone=None):
+        """Send alerts by email/SMS (through the dispatcher when one is attached) and to the webhook"""
+        _count_alerts(ALERTS_NOTIFIED, alerts)
         for alert in alerts:
-            # Log the alert
-            self.alert_log.append(alert)
+            emails, phones = self._recipients(alert, email, phone)
+            if not (EMAIL_USER and EMAIL_PASS):
+                emails = []
+            if not (TWILIO_SID and TWILIO_TOKEN):
+                phones = []
             
-            # Send email alert
-            if email and EMAIL_USER and EMAIL_PASS:
-                self.send_email_alert(alert, email)
+            if self.dispatcher is not None:
+                # Hand off to the dispatch workers in bulk and return immediately
+                self.dispatcher.submit_many('email', alert, emails)
+                self.dispatcher.submit_many('sms', alert, phones)
+                continue
             
-            # Send SMS alert
-            if phone and TWILIO_SID and TWILIO_TOKEN:
-                self.send_sms_alert(alert, phone)
-        
-        return alerts
+            # Send email alerts
+            for recipient_email in emails:
+                self.send_email_alert(alert, recipient_email)
+            
+            # Send SMS alerts
+            if phones:
+                self.send_sms_alert(alert, phones)
 
-    def save_alert_log(self, filename="data/alert_log.csv"):
-        """Save alert log to CSV file"""
-        if self.alert_log:
-            df = pd.DataFrame(self.alert_log)
-            df.to_csv(filename, index=False)
-            print(f"Alert log saved to {filename}")
+        if WEBHOOK_URL and alerts:
+            self.send_webhook_alerts(alerts)
 
+    def send_webhook_alerts(self, alerts):
+        """
+        Push alerts to the incident webhook: batched in the background when a dispatcher
+        is attached, otherwise posted now as one payload
+        """
+        webhook = get_webhook_channel()
+        if self.dispatcher is not None:
+            for alert in alerts:
+                webhook.queue_alert(alert)
+            DELIVERIES.labels('webhook', 'queued').inc(len(alerts))
+            return True
+        try:
+            with DELIVERY_SECONDS.labels('webhook').time():
+                webhook.post_batch(alerts)
+            DELIVERIES.labels('webhook', 'delivered').inc(len(alerts))
+            logger.info(f"Webhook alert batch sent ({len(alerts)} alerts)")
+            return True
+        except Exception as e:
+            DELIVERIES.labels('webhook', 'failed').inc(len(alerts))
+            logger.error(f"Webhook alert failed: {e}")
+            return False
 
-def check_forecast_alerts(city='Delhi', email=None, phone=None):
-    """Check forecast data for potential alerts"""
+    def check_forecast_frame(self, forecast, min_probability=0.5):
+        """
+        Vectorized threshold check over every step of a batched forecast frame
+        (city, metric, ds, yhat, yhat_lower, yhat_upper). The Prophet interval gives each
+        step an exceedance probability; steps at or above min_probability are returned.
+        """
+        table = self.threshold_table
+        metric_codes = pd.Index(table.metrics).get_indexer(forecast['metric'])
+        known = np.flatnonzero(metric_codes >= 0)
+        metric_codes = metric_codes[known]
+        city_codes = table.city_codes(forecast['city'].to_numpy()[known])
+
+        yhat = forecast['yhat'].to_numpy(dtype=float)[known]
+        sigma = (forecast['yhat_upper'].to_numpy(dtype=float)[known] -
+                 forecast['yhat_lower'].to_numpy(dtype=float)[known]) / (2 * FORECAST_INTERVAL_Z)
+        high = table.high[city_codes, metric_codes]
+        low = table.low[city_codes, metric_codes]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p_high = np.where(sigma > 0, ndtr((yhat - high) / sigma), (yhat > high).astype(float))
+            p_low = np.where(sigma > 0, ndtr((low - yhat) / sigma), (yhat < low).astype(float))
+
+        frames = []
+        for kind, severity, probability, limit in (('high', 'HIGH', p_high, high),
+                                                   ('low', 'MEDIUM', p_low, low)):
+            idx = np.flatnonzero(probability >= min_probability)
+            rows = known[idx]
+            frames.append(pd.DataFrame({
+                'city': forecast['city'].to_numpy()[rows],
+                'metric': forecast['metric'].to_numpy()[rows],
+                'timestamp': forecast['ds'].to_numpy()[rows],
+                'value': yhat[idx],
+                'threshold': limit[idx],
+                'type': kind,
+                'severity': severity,
+                'probability': probability[idx],
+            }))
+        return pd.concat(frames, ignore_index=True).sort_values(['city', 'metric', 'timestamp'],
+                                                               ignore_index=True)
+
+    def save_alert_log(self, store=None):
+        """Append alerts logged since the last save to the alert store"""
+        pending = self.alert_log[self._saved_count:]
+        if pending:
+            store = store or get_alert_store()
+            store.append(pending)
+            self._saved_count = len(self.alert_log)
+            logger.info(f"Appended {len(pending)} alerts to {store.path}")
+
+
+def benchmark_check_thresholds_frame(n_rows=2_000_000, seed=0):
+    """Time check_thresholds_frame on a synthetic multi-city frame and report rows/second"""
+    rng = np.random.default_rng(seed)
+    cities = np.array(['Delhi', 'Mumbai', 'London', 'New York'])
+    df = pd.DataFrame({
+        'timestamp': pd.date_range('2020-01-01', periods=n_rows, freq='min'),
+        'city': pd.Categorical(cities[rng.integers(0, len(cities), n_rows)]),
+        'temperature': rng.normal(28, 8, n_rows),
+        'aqi': rng.normal(130, 50, n_rows),
+        'rainfall': rng.exponential(5, n_rows),
+        'humidity': rng.normal(65, 15, n_rows),
+    })
+    alert_system = ClimateAlertSystem()
+    start = time.perf_counter()
+    alerts = alert_system.check_thresholds_frame(df)
+    elapsed = time.perf_counter() - start
+    print(f"Checked {n_rows:,} rows in {elapsed:.3f}s "
+          f"({n_rows / elapsed:,.0f} rows/s), {len(alerts):,} alerts")
+    return n_rows / elapsed
+
+
+def build_forecast_frame(cities, metrics=FORECAST_METRICS, periods=24, model_dir="data"):
+    """Forecast the next `periods` hours for every trained city/metric model as one long frame"""
+    frames = []
+    for city in cities:
+        for metric in metrics:
+            path = os.path.join(model_dir, f"prophet_{city}_{metric}.joblib")
+            if not os.path.exists(path):
+                continue
+            model = joblib.load(path)
+            # Only the horizon is needed, not the fitted history
+            future = model.make_future_dataframe(periods=periods, freq='h').tail(periods)
+            forecast = model.predict(future)[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+            frames.append(forecast.assign(city=city, metric=metric))
+    if not frames:
+        return pd.DataFrame(columns=['ds', 'yhat', 'yhat_lower', 'yhat_upper', 'city', 'metric'])
+    return pd.concat(frames, ignore_index=True)
+
+
+def summarize_forecast_alerts(step_alerts):
+    """Collapse per-step forecast alerts into one alert per city/metric/direction"""
+    alerts = []
+    for (city, metric, kind), group in step_alerts.groupby(['city', 'metric', 'type'], sort=False):
+        peak = group['value'].idxmax() if kind == 'high' else group['value'].idxmin()
+        first = group.iloc[0]
+        alerts.append({
+            'metric': metric,
+            'value': round(float(group.at[peak, 'value']), 2),
+            'threshold': float(first['threshold']),
+            'type': kind,
+            'severity': first['severity'],
+            'timestamp': pd.Timestamp(first['timestamp']).to_pydatetime(),
+            'city': city,
+            'probability': round(float(group['probability'].max()), 3),
+            'steps': len(group),
+        })
+    return alerts
+
+
+_default_rule_engine = None
+_default_rule_engine_lock = threading.Lock()
+
+
+def get_rule_engine(history_path=HISTORY_PATH):
+    """
+    Process-wide RuleEngine for real-time checks. Its ring buffers must outlive a
+    single check for windowed rules to see any history, so they are primed from the
+    stored history once and then fed every new reading.
+    """
+    global _default_rule_engine
+    with _default_rule_engine_lock:
+        if _default_rule_engine is None:
+            engine = RuleEngine()
+            if engine.rules and os.path.exists(history_path):
+                history = pd.read_csv(history_path)
+                history['timestamp'] = pd.to_datetime(history['timestamp'])
+                engine.prime(history)
+            _default_rule_engine = engine
+        return _default_rule_engine
+
+
+def check_realtime_alerts(path=REALTIME_PATH, email=None, phone=None, dispatcher=None,
+                          state_engine=None):
+    """
+    Threshold and windowed-rule checks on the latest real-time reading per city.
+    Readings the rule engine has already seen are skipped. Returns the alerts raised,
+    or None when the check itself failed.
+    """
     try:
-        # Load the trained model
-        model = joblib.load(f"data/prophet_{city}_temperature.joblib")
-        
-        # Get forecast
-        future = model.make_future_dataframe(periods=24, freq='H')
-        forecast = model.predict(future)
-        
-        # Get the latest forecast values
-        latest_forecast = forecast.iloc[-1]
-        
-        # Check for temperature alerts
-        alert_system = ClimateAlertSystem()
-        forecast_data = {
-            'temperature': latest_forecast['yhat'],
-            'city': city
-        }
-        
-        alerts = alert_system.process_alerts(forecast_data, email, phone)
+        df = pd.read_csv(path)
+        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        rule_engine = get_rule_engine()
+        alert_system = ClimateAlertSystem(dispatcher=dispatcher,
+                                          state_engine=state_engine or AlertStateEngine(),
+                                          rule_engine=rule_engine,
+                                          subscriptions=get_subscription_store())
+        alerts = []
+        for row in df.sort_values('timestamp').groupby('city').tail(1).to_dict('records'):
+            last_seen = rule_engine.last_seen.get(row['city'])
+            if last_seen is not None and row['timestamp'] <= last_seen:
+                continue
+            row['timestamp'] = row['timestamp'].to_pydatetime()
+            city_alerts = alert_system.process_alerts(row, email, phone)
+            if city_alerts:
+                logger.warning(f"Found {len(city_alerts)} real-time alerts for {row['city']}",
+                               extra={'city': row['city']})
+            alerts += city_alerts
+        alert_system.save_alert_log()
+        return alerts
+    except Exception as e:
+        logger.exception(f"Real-time alert check failed: {e}")
+        return None
+
+
+def check_forecast_alerts(city='Delhi', email=None, phone=None, dispatcher=None,
+                          periods=24, min_probability=0.5, state_engine=None):
+    """
+    Check every forecast step of every metric for a city (or list of cities) in one
+    batched, vectorized pass. Pass a shared state_engine when checking cities concurrently.
+    Returns the alerts raised, or None when the check itself failed.
+    """
+    cities = [city] if isinstance(city, str) else list(city)
+    start = time.perf_counter()
+    try:
+        forecast = build_forecast_frame(cities, periods=periods)
+        state_engine = state_engine or AlertStateEngine()
+        alert_system = ClimateAlertSystem(dispatcher=dispatcher, state_engine=state_engine,
+                                          subscriptions=get_subscription_store())
+        alerts = summarize_forecast_alerts(alert_system.check_forecast_frame(forecast, min_probability))
         
-        if alerts:
-            print(f"Found {len(alerts)} forecast alerts for {city}")
-            alert_system.save_alert_log()
-        else:
-            print(f"No forecast alerts for {city}")
+        # The nearest forecast step decides whether an open alert has recovered
+        nearest = forecast.sort_values('ds').groupby(['city', 'metric'])['yhat'].first()
+        for name in cities:
+            city_alerts = [alert for alert in alerts if alert['city'] == name]
+            readings = {metric: value for (c, metric), value in nearest.items() if c == name}
+            to_notify = state_engine.filter_alerts(name, readings, city_alerts, source='forecast')
+            alert_system.alert_log.extend(city_alerts)
+            _count_alerts(ALERTS_DETECTED, city_alerts, 'metric')
+            alert_system.dispatch_alerts(to_notify, email, phone)
             
+            if city_alerts:
+                logger.warning(f"Found {len(city_alerts)} forecast alerts for {name} "
+                               f"({len(to_notify)} notified)", extra={'city': name})
+            else:
+                logger.info(f"No forecast alerts for {name}", extra={'city': name})
+        
+        alert_system.save_alert_log()
         return alerts
         
     except Exception as e:
-        print(f"Forecast alert check failed: {e}")
-        return []
+        logger.exception(f"Forecast alert check failed: {e}")
+        return None
+    finally:
+        FORECAST_CHECK_SECONDS.observe(time.perf_counter() - start)
 
 
 if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--benchmark":
+        benchmark_check_thresholds_frame()
+        sys.exit(0)
+
+    setup_logging(log_path=None)
+
     # Example usage
     alert_system = ClimateAlertSystem()
     
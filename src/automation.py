@@ -2,85 +2,114 @@
 automation.py
 Automated pipeline execution and logging for climate risk prediction system.
 """
-import schedule
+import asyncio
 import time
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
 from data_collection import collect_realtime_data
 from data_preprocessing import preprocess_realtime_data
-from modeling import train_prophet, save_model
-from alert_system import check_forecast_alerts
+from modeling import train_prophet, save_model, load_best_params, DEFAULT_TRAINING_WINDOW
+from alert_system import (check_forecast_alerts, check_realtime_alerts, get_dispatcher,
+                          shutdown_dispatcher, drain_webhook, THRESHOLDS_PATH)
+from alert_state import AlertStateEngine
+from subscriptions import SUBSCRIPTIONS_PATH, STATIONS_PATH
+from pipeline import Pipeline
+from scheduler import Scheduler
+from metrics import start_metrics_server, METRICS_PORT
+from structured_logging import log_context, setup_logging as setup_structured_logging, LOG_PATH
 import pandas as pd
 
+CITIES = ["Delhi", "Mumbai", "London", "New York"]
+METRICS = ['temperature', 'humidity', 'rainfall', 'aqi']
+PIPELINE_WORKERS = 4
+ALERT_PERIODS = 24
+ALERT_MIN_PROBABILITY = 0.5
+# A failed run younger than this is resumed instead of starting over
+RESUME_WINDOW = timedelta(hours=12)
+# Forecast alert checks run at most once per interval while models and config are unchanged;
+# matches the hourly alerts job
+ALERT_CHECK_INTERVAL = timedelta(hours=1)
+
 
 # Setup logging
 def setup_logging():
-    """Setup logging configuration"""
-    if not os.path.exists('logs'):
-        os.makedirs('logs')
-    
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler('logs/climate_pipeline.log'),
-            logging.StreamHandler()
-        ]
-    )
+    """Queue-based logging: JSON lines in logs/climate_pipeline.log, plain text on the console"""
+    setup_structured_logging(LOG_PATH)
     return logging.getLogger(__name__)
 
 
 def run_data_collection():
-    """Run data collection pipeline"""
+    """Run data collection pipeline; returns the number of records collected"""
     logger = logging.getLogger(__name__)
     try:
         logger.info("Starting data collection...")
-        cities = ["Delhi", "Mumbai", "London", "New York"]
-        collect_realtime_data(cities)
+        df = collect_realtime_data(CITIES)
         logger.info("Data collection completed successfully")
-        return True
+        return len(df)
     except Exception as e:
         logger.error(f"Data collection failed: {e}")
         return False
 
 
 def run_preprocessing():
-    """Run data preprocessing pipeline"""
+    """Run data preprocessing pipeline; returns the number of processed rows"""
     logger = logging.getLogger(__name__)
     try:
         logger.info("Starting data preprocessing...")
-        preprocess_realtime_data()
+        df = preprocess_realtime_data()
         logger.info("Data preprocessing completed successfully")
-        return True
+        return len(df)
     except Exception as e:
         logger.error(f"Data preprocessing failed: {e}")
         return False
 
 
+def load_training_data():
+    df = pd.read_csv("data/combined_climate.csv")
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    return df
+
+
+def train_city_models(city, df):
+    """
+    Train and save one model per metric for a city; returns the city's row count,
+    or False when any metric could not be trained
+    """
+    logger = logging.getLogger(__name__)
+    rows = int((df['city'] == city).sum())
+    failed = []
+    for metric in METRICS:
+        try:
+            city_data = df[df['city'] == city].dropna(subset=[metric])
+            if len(city_data) >= 2:  # Minimum data requirement
+                start = time.perf_counter()
+                model = train_prophet(df, metric, city, window=DEFAULT_TRAINING_WINDOW,
+                                      params=load_best_params(city, metric))
+                save_model(model, f"data/prophet_{city}_{metric}.joblib")
+                logger.info(f"Model trained for {city} - {metric}",
+                            extra={'city': city, 'duration': time.perf_counter() - start})
+            else:
+                logger.warning(f"Insufficient data for {city} - {metric}")
+                failed.append(metric)
+        except Exception as e:
+            logger.error(f"Model training failed for {city} - {metric}: {e}")
+            failed.append(metric)
+    return False if failed else rows
+
+
 def run_model_training():
     """Run model training for all cities and metrics"""
     logger = logging.getLogger(__name__)
     try:
         logger.info("Starting model training...")
-        df = pd.read_csv("data/combined_climate.csv")
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-        
-        cities = df['city'].unique()
-        metrics = ['temperature', 'humidity', 'rainfall', 'aqi']
+        df = load_training_data()
         
-        for city in cities:
-            for metric in metrics:
-                try:
-                    city_data = df[df['city'] == city].dropna(subset=[metric])
-                    if len(city_data) >= 2:  # Minimum data requirement
-                        model = train_prophet(df, metric, city)
-                        save_model(model, f"data/prophet_{city}_{metric}.joblib")
-                        logger.info(f"Model trained for {city} - {metric}")
-                    else:
-                        logger.warning(f"Insufficient data for {city} - {metric}")
-                except Exception as e:
-                    logger.error(f"Model training failed for {city} - {metric}: {e}")
+        failed = [city for city in df['city'].unique() if train_city_models(city, df) is False]
+        if failed:
+            logger.error(f"Model training incomplete for {failed}")
+            return False
         
         logger.info("Model training completed")
         return True
@@ -89,57 +118,147 @@ def run_model_training():
         return False
 
 
-def run_alert_checks():
-    """Run alert checks for all cities"""
+def run_city_training(city, retrain=False):
+    """Pipeline stage: train a city's models unless they already exist"""
+    logger = logging.getLogger(__name__)
+    with log_context(city=city):
+        if not retrain and all(os.path.exists(path) for path in model_paths(city)):
+            logger.info(f"Using existing trained models for {city}")
+            return True
+        try:
+            return train_city_models(city, load_training_data())
+        except Exception as e:
+            logger.error(f"Model training failed for {city}: {e}")
+            return False
+
+
+def run_city_alert_checks(city, dispatcher=None, state_engine=None):
+    """Pipeline stage: forecast alert checks for one city; returns the number of alerts raised"""
+    logger = logging.getLogger(__name__)
+    with log_context(city=city):
+        alerts = check_forecast_alerts(city, dispatcher=dispatcher, state_engine=state_engine,
+                                       periods=ALERT_PERIODS, min_probability=ALERT_MIN_PROBABILITY)
+        if alerts is None:
+            # Fail the stage so its fingerprint is not recorded and the next run retries
+            logger.error(f"Forecast alert check failed for {city}")
+            return False
+        if alerts:
+            logger.warning(f"Found {len(alerts)} alerts for {city}")
+        else:
+            logger.info(f"No alerts for {city}")
+    return len(alerts)
+
+
+def run_realtime_alerts(dispatcher=None, state_engine=None):
+    """Pipeline stage: threshold and windowed-rule checks on the latest readings; returns alerts raised"""
+    logger = logging.getLogger(__name__)
+    alerts = check_realtime_alerts(dispatcher=dispatcher, state_engine=state_engine)
+    if alerts is None:
+        logger.error("Real-time alert check failed")
+        return False
+    return len(alerts)
+
+
+def model_paths(city):
+    return [f"data/prophet_{city}_{metric}.joblib" for metric in METRICS]
+
+
+def add_alert_stages(pipeline, cities, dispatcher=None, state_engine=None, deps=None):
+    """
+    One alerts:<city> stage per city, cached on the city's models and the alert config.
+    The current ALERT_CHECK_INTERVAL slot is part of the config, so each hourly check
+    runs once (and open alerts get their reminders); a second trigger in the same hour,
+    e.g. data_landed just before the cron, is a cache hit.
+    """
+    config = {
+        'periods': ALERT_PERIODS,
+        'min_probability': ALERT_MIN_PROBABILITY,
+        'check_slot': int(time.time() // ALERT_CHECK_INTERVAL.total_seconds()),
+    }
+    for city in cities:
+        pipeline.add(f'alerts:{city}', partial(run_city_alert_checks, city, dispatcher, state_engine),
+                     deps=deps(city) if deps else (),
+                     inputs=model_paths(city) + [THRESHOLDS_PATH, SUBSCRIPTIONS_PATH, STATIONS_PATH],
+                     config=config)
+    return pipeline
+
+
+def run_alert_checks(use_cache=True):
+    """Run alert checks for all cities, skipping cities whose models and config are unchanged"""
     logger = logging.getLogger(__name__)
     try:
         logger.info("Starting alert checks...")
-        cities = ["Delhi", "Mumbai", "London", "New York"]
+        # Deliveries run on the dispatcher's workers so one slow provider
+        # does not hold up checks for the remaining cities
+        # The dispatcher is shared across runs so recipient limits span runs too
+        dispatcher = get_dispatcher()
         
-        for city in cities:
-            alerts = check_forecast_alerts(city)
-            if alerts:
-                logger.warning(f"Found {len(alerts)} alerts for {city}")
-            else:
-                logger.info(f"No alerts for {city}")
+        try:
+            pipeline = add_alert_stages(Pipeline("alerts", max_workers=PIPELINE_WORKERS), CITIES,
+                                        dispatcher, AlertStateEngine())
+            pipeline.run(use_cache)
+        finally:
+            dispatcher.join(timeout=300)
+            drain_webhook()
         
-        logger.info("Alert checks completed")
-        return True
+        logger.info(f"Alert checks completed, delivery stats since start: {dispatcher.stats}")
+        return pipeline.succeeded
     except Exception as e:
         logger.error(f"Alert checks failed: {e}")
         return False
 
 
-def run_full_pipeline():
-    """Run the complete climate prediction pipeline"""
+def build_pipeline(cities=CITIES, retrain=False, dispatcher=None, state_engine=None):
+    """
+    collect -> preprocess -> train:<city> -> alerts:<city>, plus realtime_alerts on the
+    freshly collected readings after preprocess. Each city's alert check
+    starts as soon as that city's models are ready, independently of the other cities.
+    Alert stages are skipped when their inputs are unchanged. Preprocess is not cached:
+    collect writes fresh readings on every run, so its input never repeats.
+    """
+    pipeline = Pipeline("climate", max_workers=PIPELINE_WORKERS)
+    pipeline.add('collect', run_data_collection, outputs=["data/realtime_climate.csv"])
+    pipeline.add('preprocess', run_preprocessing, deps=['collect'],
+                 outputs=["data/processed_climate.csv"])
+    pipeline.add('realtime_alerts', partial(run_realtime_alerts, dispatcher, state_engine),
+                 deps=['preprocess'])
+    for city in cities:
+        pipeline.add(f'train:{city}', partial(run_city_training, city, retrain), deps=['preprocess'],
+                     outputs=model_paths(city))
+    add_alert_stages(pipeline, cities, dispatcher, state_engine, deps=lambda city: [f'train:{city}'])
+    return pipeline
+
+
+def run_full_pipeline(retrain=False, use_cache=True, resume='auto'):
+    """
+    Run the complete climate prediction pipeline. resume=True continues the last failed
+    run from where it stopped, 'auto' does so only within RESUME_WINDOW, False starts over.
+    """
     logger = logging.getLogger(__name__)
     logger.info("=" * 50)
     logger.info("STARTING FULL CLIMATE PREDICTION PIPELINE")
     logger.info("=" * 50)
     
-    # Step 1: Data Collection
-    if not run_data_collection():
-        logger.error("Pipeline failed at data collection step")
-        return False
-    
-    # Step 2: Data Preprocessing
-    if not run_preprocessing():
-        logger.error("Pipeline failed at preprocessing step")
-        return False
-    
-    # Step 3: Model Training (optional, only if models don't exist)
-    model_exists = os.path.exists("data/prophet_Delhi_temperature.joblib")
-    if not model_exists:
-        logger.info("No existing models found, training new models...")
-        if not run_model_training():
-            logger.error("Pipeline failed at model training step")
-            return False
-    else:
-        logger.info("Using existing trained models")
+    # City alert stages share one dispatcher and one open-alert state
+    dispatcher = get_dispatcher()
+    try:
+        pipeline = build_pipeline(retrain=retrain, dispatcher=dispatcher,
+                                  state_engine=AlertStateEngine())
+        previous = pipeline.latest_run() if resume else None
+        if previous is not None and previous.status == 'succeeded':
+            previous = None
+        if previous is not None and resume == 'auto' and \
+                datetime.now() - previous.started_at > RESUME_WINDOW:
+            logger.info(f"Not resuming run {previous.run_id}: older than {RESUME_WINDOW}")
+            previous = None
+        results = pipeline.run(use_cache, resume_from=previous)
+    finally:
+        dispatcher.join(timeout=300)
+        drain_webhook()
     
-    # Step 4: Alert Checks
-    if not run_alert_checks():
-        logger.error("Pipeline failed at alert checks step")
+    if not pipeline.succeeded:
+        failed = [name for name, state in results.items() if state in ('failed', 'skipped')]
+        logger.error(f"Pipeline did not complete, stages not succeeded: {failed}")
         return False
     
     logger.info("=" * 50)
@@ -148,6 +267,21 @@ def run_full_pipeline():
     return True
 
 
+def run_ingest():
+    """Data collection, preprocessing and real-time alert checks, in order"""
+    dispatcher = get_dispatcher()
+    pipeline = Pipeline("ingest", max_workers=1)
+    pipeline.add('collect', run_data_collection)
+    pipeline.add('preprocess', run_preprocessing, deps=['collect'])
+    pipeline.add('realtime_alerts', partial(run_realtime_alerts, dispatcher), deps=['preprocess'])
+    try:
+        pipeline.run()
+    finally:
+        dispatcher.join(timeout=300)
+        drain_webhook()
+    return pipeline.succeeded
+
+
 def create_windows_task_scheduler_script():
     """Create a Windows Task Scheduler batch script"""
     batch_content = f"""@echo off
@@ -167,27 +301,32 @@ python src/automation.py --run-once
     print(f"5. Program: {os.getcwd()}\\run_climate_pipeline.bat")
 
 
-def schedule_jobs():
-    """Schedule automated jobs"""
+def schedule_jobs(scheduler=None):
+    """Register the automated jobs on an asyncio Scheduler"""
     logger = logging.getLogger(__name__)
+    scheduler = scheduler or Scheduler(max_workers=PIPELINE_WORKERS)
     
-    # Schedule data collection every 3 hours
-    schedule.every(3).hours.do(run_data_collection)
+    # Collect, preprocess and check the new readings every 3 hours; fresh data triggers
+    # forecast alert checks. Both alert jobs update the open-alert state, so they never overlap.
+    # Offset by an hour so ingest never fires with the 6 AM full pipeline
+    scheduler.add_job('ingest', run_ingest, cron="0 1-23/3 * * *", emits='data_landed',
+                      conflicts=['full_pipeline', 'alerts'])
     
-    # Schedule preprocessing every 3 hours (after data collection)
-    schedule.every(3).hours.do(run_preprocessing)
+    # Alert checks every hour and whenever new data lands
+    scheduler.add_job('alerts', run_alert_checks, cron="5 * * * *", events=['data_landed'],
+                      conflicts=['full_pipeline', 'ingest'])
     
-    # Schedule alert checks every hour
-    schedule.every().hour.do(run_alert_checks)
+    # Full pipeline once daily at 6 AM
+    scheduler.add_job('full_pipeline', run_full_pipeline, cron="0 6 * * *",
+                      conflicts=['ingest', 'alerts'])
     
-    # Schedule full pipeline once daily at 6 AM
-    schedule.every().day.at("06:00").do(run_full_pipeline)
+    # Historical data refreshed outside the pipeline counts as new data too
+    scheduler.watch_file("data/combined_climate.csv", 'data_landed', interval=60)
     
     logger.info("Scheduled jobs:")
-    logger.info("- Data collection: Every 3 hours")
-    logger.info("- Data preprocessing: Every 3 hours")
-    logger.info("- Alert checks: Every hour")
-    logger.info("- Full pipeline: Daily at 6:00 AM")
+    for line in scheduler.describe():
+        logger.info(line)
+    return scheduler
 
 
 def main():
@@ -197,8 +336,13 @@ def main():
     logger = setup_logging()
     
     if len(sys.argv) > 1 and sys.argv[1] == "--run-once":
-        # Run pipeline once and exit (for Task Scheduler)
-        run_full_pipeline()
+        # Run pipeline once and exit (for Task Scheduler); --no-cache re-runs every stage,
+        # --resume continues the last failed run, --fresh never resumes
+        resume = True if "--resume" in sys.argv else False if "--fresh" in sys.argv else 'auto'
+        try:
+            run_full_pipeline(use_cache="--no-cache" not in sys.argv, resume=resume)
+        finally:
+            shutdown_dispatcher()
         return
     
     if len(sys.argv) > 1 and sys.argv[1] == "--create-task":
@@ -208,14 +352,21 @@ def main():
     
     # Run continuous scheduling
     logger.info("Starting climate prediction automation...")
-    schedule_jobs()
+    scheduler = schedule_jobs()
+    try:
+        metrics_server = start_metrics_server(METRICS_PORT)
+        logger.info(f"Metrics at {metrics_server.url}")
+    except OSError as e:
+        logger.warning(f"Metrics endpoint not started on port {METRICS_PORT}: {e}")
     
     try:
-        while True:
-            schedule.run_pending()
-            time.sleep(60)  # Check every minute
+        asyncio.run(scheduler.run())
     except KeyboardInterrupt:
-        logger.info("Automation stopped by user")
+        pass
+    finally:
+        # Recipients still over their limit get their summary now rather than never
+        shutdown_dispatcher()
+    logger.info("Automation stopped")
 
 
 if __name__ == "__main__":
@@ -425,7 +425,8 @@ def main():
             'temperature': latest_data['temperature'],
             'humidity': latest_data['humidity'],
             'rainfall': latest_data['rainfall'],
-            'aqi': latest_data['aqi']
+            'aqi': latest_data['aqi'],
+            'city': selected_city
         }
         
         # Check for alerts with futuristic display
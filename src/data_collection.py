@@ -4,23 +4,38 @@ Collects real-time climate data from OpenWeatherMap and AQICN APIs,
 and downloads historical datasets from Kaggle/NASA.
 """
 import os
+import time
+import logging
 import requests
 import pandas as pd
 from datetime import datetime
 from dotenv import load_dotenv
+import metrics
+from structured_logging import setup_logging
 
 # Load environment variables
 load_dotenv()
 OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY')
 AQICN_API_KEY = os.getenv('AQICN_API_KEY')
 
+FETCH_SECONDS = metrics.histogram('climate_fetch_duration_seconds', "API fetch latency", ['source'])
+FETCH_ERRORS = metrics.counter('climate_fetch_errors_total', "Failed API fetches", ['source'])
+RECORDS_COLLECTED = metrics.counter('climate_records_collected_total', "Real-time records collected",
+                                    ['city'])
+LAST_COLLECTION = metrics.gauge('climate_last_collection_timestamp_seconds',
+                                "Unix time of the last completed collection")
+
+logger = logging.getLogger(__name__)
+
 # --- Real-time Data Collection ---
 def fetch_openweather(city):
     url = f"https://api.openweathermap.org/data/2.5/weather?q={city}&appid={OPENWEATHER_API_KEY}&units=metric"
+    start = time.perf_counter()
     try:
         resp = requests.get(url)
         resp.raise_for_status()
         data = resp.json()
+        FETCH_SECONDS.labels('openweather').observe(time.perf_counter() - start)
         return {
             'timestamp': datetime.utcnow(),
             'city': city,
@@ -29,23 +44,27 @@ def fetch_openweather(city):
             'rainfall': data.get('rain', {}).get('1h', 0),
         }
     except Exception as e:
-        print(f"OpenWeatherMap error: {e}")
+        FETCH_ERRORS.labels('openweather').inc()
+        logger.error(f"OpenWeatherMap error for {city}: {e}", extra={'city': city})
         return None
 
 def fetch_aqicn(city):
     url = f"https://api.waqi.info/feed/{city}/?token={AQICN_API_KEY}"
+    start = time.perf_counter()
     try:
         resp = requests.get(url)
         resp.raise_for_status()
         data = resp.json()
         aqi = data['data']['aqi'] if 'data' in data and 'aqi' in data['data'] else None
+        FETCH_SECONDS.labels('aqicn').observe(time.perf_counter() - start)
         return {
             'timestamp': datetime.utcnow(),
             'city': city,
             'aqi': aqi
         }
     except Exception as e:
-        print(f"AQICN error: {e}")
+        FETCH_ERRORS.labels('aqicn').inc()
+        logger.error(f"AQICN error for {city}: {e}", extra={'city': city})
         return None
 
 def collect_realtime_data(cities):
@@ -56,16 +75,20 @@ def collect_realtime_data(cities):
         if weather and aqi:
             record = {**weather, **aqi}
             records.append(record)
+            RECORDS_COLLECTED.labels(city).inc()
     df = pd.DataFrame(records)
     df.to_csv("data/realtime_climate.csv", index=False)
-    print("Saved real-time data to data/realtime_climate.csv")
+    logger.info(f"Saved {len(df)} real-time records to data/realtime_climate.csv")
+    LAST_COLLECTION.set_to_current_time()
+    return df
 
 # --- Historical Data Download (Placeholder) ---
 def download_historical_data():
     # Download from Kaggle/NASA manually or via API
-    print("Please download historical datasets from Kaggle/NASA and place in data/historical/")
+    logger.info("Please download historical datasets from Kaggle/NASA and place in data/historical/")
 
 if __name__ == "__main__":
+    setup_logging(log_path=None)
     cities = ["Delhi", "Mumbai", "London", "New York"]
     collect_realtime_data(cities)
     download_historical_data()
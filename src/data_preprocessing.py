@@ -2,9 +2,13 @@
 data_preprocessing.py
 Cleans and formats climate data for time-series modeling.
 """
+import logging
 import pandas as pd
 import numpy as np
 from datetime import datetime
+from structured_logging import setup_logging
+
+logger = logging.getLogger(__name__)
 
 def preprocess_realtime_data(input_path="data/realtime_climate.csv", output_path="data/processed_climate.csv"):
     df = pd.read_csv(input_path)
@@ -21,7 +25,9 @@ def preprocess_realtime_data(input_path="data/realtime_climate.csv", output_path
     df = df.drop_duplicates(subset=['timestamp', 'city'])
     # Save processed data
     df.to_csv(output_path, index=False)
-    print(f"Processed data saved to {output_path}")
+    logger.info(f"Processed data saved to {output_path}")
+    return df
 
 if __name__ == "__main__":
+    setup_logging(log_path=None)
     preprocess_realtime_data()
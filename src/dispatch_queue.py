@@ -0,0 +1,379 @@
+"""
+dispatch_queue.py
+Asynchronous notification dispatch. Each channel (email, SMS, ...) gets a bounded
+priority queue ordered by alert severity and its own worker pool; failed deliveries
+are retried with exponential backoff and finally written to a dead-letter file, so
+alert detection never waits on a slow provider. Token buckets cap each channel and
+each recipient, and notifications over a recipient's limit are rolled into one
+summary instead of being sent.
+"""
+import os
+import json
+import time
+import heapq
+import queue
+import random
+import itertools
+import sys
+import threading
+from datetime import datetime
+from rate_limit import TokenBucket
+
+DEAD_LETTER_PATH = "data/dead_letter.jsonl"
+# Per-recipient budgets saved at stop, so separate --run-once processes share the limits
+RECIPIENT_STATE_PATH = "data/recipient_limits.json"
+
+# Lower numbers are delivered first
+SEVERITY_PRIORITY = {'CRITICAL': 0, 'HIGH': 1, 'MEDIUM': 2, 'LOW': 3}
+DEFAULT_PRIORITY = 2
+
+_STOP = object()
+
+
+def alert_priority(alert):
+    return SEVERITY_PRIORITY.get(alert.get('severity'), DEFAULT_PRIORITY)
+
+
+class NotificationDispatcher:
+    """Per-channel bounded queues and worker pools with retry, backpressure and dead-lettering"""
+
+    def __init__(self, senders, workers_per_channel=2, queue_size=1000, max_retries=3,
+                 backoff_base=1.0, backoff_max=60.0, put_timeout=5.0,
+                 dead_letter_path=DEAD_LETTER_PATH, channel_rates=None,
+                 recipient_limits=None, summary_interval=30.0, state_path=None):
+        """
+        senders maps a channel name to a callable(alert, recipient) that raises on failure.
+        workers_per_channel is an int or a {channel: int} dict.
+        channel_rates maps a channel to its maximum sends per second.
+        recipient_limits maps a channel to (count, seconds): at most `count` notifications
+        per recipient per `seconds`; the overflow is summarised once capacity returns.
+        state_path, when set, keeps the recipients' remaining budgets across processes:
+        loaded here and saved by stop().
+        """
+        self.senders = senders
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.put_timeout = put_timeout
+        self.dead_letter_path = dead_letter_path
+        if isinstance(workers_per_channel, int):
+            workers_per_channel = {channel: workers_per_channel for channel in senders}
+        self.workers_per_channel = workers_per_channel
+
+        self.queues = {channel: queue.PriorityQueue(maxsize=queue_size) for channel in senders}
+        self.stats = {channel: {'submitted': 0, 'delivered': 0, 'retried': 0, 'dead_lettered': 0,
+                                'rate_limited': 0, 'summaries': 0}
+                      for channel in senders}
+        self.channel_buckets = {channel: TokenBucket(rate)
+                                for channel, rate in (channel_rates or {}).items()}
+        self.recipient_limits = recipient_limits or {}
+        for channel, (count, seconds) in self.recipient_limits.items():
+            if count <= 0 or seconds <= 0:
+                raise ValueError(f"Recipient limit for {channel} needs a positive count and period, "
+                                 f"got ({count}, {seconds})")
+        self.summary_interval = summary_interval
+        self.state_path = state_path
+        self._recipient_buckets = {}
+        self._overflow = {}
+        self._overflow_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._dead_letter_lock = threading.Lock()
+        self._retry_heap = []
+        self._retry_cond = threading.Condition()
+        self._sequence = itertools.count()
+        self._outstanding = 0
+        self._idle = threading.Condition()
+        self._threads = []
+        self._running = False
+        self._stopping = threading.Event()
+        self._load_recipient_state()
+
+    # --- Lifecycle ---
+    def start(self):
+        if self._running:
+            return self
+        self._running = True
+        self._stopping.clear()
+        for channel in self.senders:
+            for i in range(self.workers_per_channel.get(channel, 1)):
+                thread = threading.Thread(target=self._worker, args=(channel,),
+                                          name=f"dispatch-{channel}-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        retry_thread = threading.Thread(target=self._retry_loop, name="dispatch-retry", daemon=True)
+        retry_thread.start()
+        self._threads.append(retry_thread)
+        if self.recipient_limits:
+            summary_thread = threading.Thread(target=self._summary_loop, name="dispatch-summary",
+                                              daemon=True)
+            summary_thread.start()
+            self._threads.append(summary_thread)
+        return self
+
+    def join(self, timeout=None):
+        """Block until every submitted notification is delivered or dead-lettered"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._idle:
+            while self._outstanding:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._idle.wait(remaining)
+        return True
+
+    def stop(self, drain=True, timeout=None):
+        """Stop the workers, optionally waiting for queued notifications first; leftovers are dead-lettered"""
+        if drain:
+            self.join(timeout)
+            # Recipients still over their limit get their summary now rather than never
+            self._flush_summaries(force=True)
+            self.join(timeout)
+        self._running = False
+        self._stopping.set()
+        # Whatever is still queued will not be delivered; dead-letter it, which also makes
+        # room for the stop sentinels
+        self._drain_queues('shutdown')
+        for channel, q in self.queues.items():
+            for _ in range(self.workers_per_channel.get(channel, 1)):
+                try:
+                    q.put_nowait((sys.maxsize, next(self._sequence), _STOP))
+                except queue.Full:
+                    break  # refilled by a late submit; its workers are daemons
+        with self._retry_cond:
+            self._retry_cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=1)
+        self._threads = []
+        self._drain_queues('shutdown')
+        self._save_recipient_state()
+
+    def _drain_queues(self, reason):
+        for q in self.queues.values():
+            while True:
+                try:
+                    _, _, item = q.get_nowait()
+                except queue.Empty:
+                    break
+                q.task_done()
+                if item is not _STOP:
+                    self._dead_letter(item, reason)
+
+    # --- Submission ---
+    def submit(self, channel, alert, recipient, summary=False):
+        """
+        Queue a notification. Blocks for up to put_timeout when the channel queue is
+        full (backpressure); returns False and dead-letters the item if it stays full
+        or the dispatcher is stopped. summary=True skips the recipient limit, for
+        notifications that bundle alerts already admitted.
+        """
+        item = {'channel': channel, 'alert': alert, 'recipient': recipient, 'attempts': 0}
+        if summary:
+            item['summary'] = True
+        self._track(1)
+        self._count(channel, 'submitted')
+        if not self._running:
+            self._dead_letter(item, 'dispatcher stopped')
+            return False
+        try:
+            self._put(item)
+        except queue.Full:
+            self._dead_letter(item, 'queue full')
+            return False
+        return True
+
+    def _put(self, item):
+        entry = (alert_priority(item['alert']), next(self._sequence), item)
+        self.queues[item['channel']].put(entry, timeout=self.put_timeout)
+
+    def submit_many(self, channel, alert, recipients):
+        """Queue one alert for several recipients; returns the number accepted"""
+        return sum(self.submit(channel, alert, recipient) for recipient in recipients)
+
+    # --- Workers ---
+    def _worker(self, channel):
+        q = self.queues[channel]
+        sender = self.senders[channel]
+        channel_bucket = self.channel_buckets.get(channel)
+        while True:
+            _, _, item = q.get()
+            if item is _STOP:
+                q.task_done()
+                return
+            if not (item.get('summary') or item.get('admitted')):
+                if not self._recipient_allows(item):
+                    self._defer_to_summary(item)
+                    q.task_done()
+                    continue
+                item['admitted'] = True  # retries do not spend the recipient's budget again
+            if channel_bucket is not None:
+                channel_bucket.acquire()
+            try:
+                sender(item['alert'], item['recipient'])
+            except Exception as e:
+                self._handle_failure(item, e)
+            else:
+                self._count(channel, 'delivered')
+                self._track(-1)
+            finally:
+                q.task_done()
+
+    def _handle_failure(self, item, error):
+        item['attempts'] += 1
+        if item['attempts'] > self.max_retries or not self._running:
+            self._dead_letter(item, repr(error))
+            return
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (item['attempts'] - 1))
+        delay *= random.uniform(0.5, 1.0)
+        self._count(item['channel'], 'retried')
+        with self._retry_cond:
+            heapq.heappush(self._retry_heap, (time.monotonic() + delay, next(self._sequence), item))
+            self._retry_cond.notify()
+
+    def _retry_loop(self):
+        while self._running:
+            with self._retry_cond:
+                while self._running and (not self._retry_heap or
+                                         self._retry_heap[0][0] > time.monotonic()):
+                    timeout = self._retry_heap[0][0] - time.monotonic() if self._retry_heap else None
+                    self._retry_cond.wait(timeout)
+                if not self._running:
+                    break
+                _, _, item = heapq.heappop(self._retry_heap)
+            try:
+                self._put(item)
+            except queue.Full:
+                self._dead_letter(item, 'queue full on retry')
+        # Anything still waiting for a retry at shutdown is dead-lettered
+        with self._retry_cond:
+            pending, self._retry_heap = self._retry_heap, []
+        for _, _, item in pending:
+            self._dead_letter(item, 'dispatcher stopped')
+
+    # --- Per-recipient rate limiting ---
+    def _recipient_bucket(self, channel, recipient):
+        limit = self.recipient_limits.get(channel)
+        if limit is None:
+            return None
+        key = (channel, recipient)
+        with self._overflow_lock:
+            bucket = self._recipient_buckets.get(key)
+            if bucket is None:
+                count, seconds = limit
+                bucket = self._recipient_buckets[key] = TokenBucket(count / seconds, count)
+        return bucket
+
+    def _load_recipient_state(self):
+        """Restore saved recipient budgets, refilled for the time since they were saved"""
+        if not (self.state_path and self.recipient_limits and os.path.exists(self.state_path)):
+            return
+        try:
+            with open(self.state_path) as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for record in records:
+            limit = self.recipient_limits.get(record['channel'])
+            if limit is None:
+                continue
+            count, seconds = limit
+            tokens = record['tokens'] + max(now - record['saved_at'], 0) * count / seconds
+            if tokens < count:
+                bucket = self._recipient_bucket(record['channel'], record['recipient'])
+                bucket.set_level(tokens)
+
+    def _save_recipient_state(self):
+        """Write the budgets of recipients not yet back at their full limit"""
+        if not (self.state_path and self.recipient_limits):
+            return
+        now = time.time()
+        with self._overflow_lock:
+            buckets = list(self._recipient_buckets.items())
+        records = []
+        for (channel, recipient), bucket in buckets:
+            tokens = bucket.level()
+            if tokens < bucket.capacity:
+                records.append({'channel': channel, 'recipient': recipient, 'tokens': tokens,
+                                'saved_at': now})
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(records, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _recipient_allows(self, item):
+        bucket = self._recipient_bucket(item['channel'], item['recipient'])
+        return bucket is None or bucket.try_acquire()
+
+    def _defer_to_summary(self, item):
+        """Hold back a rate-limited notification for the recipient's next summary"""
+        with self._overflow_lock:
+            self._overflow.setdefault((item['channel'], item['recipient']), []).append(item['alert'])
+        self._count(item['channel'], 'rate_limited')
+        self._track(-1)
+
+    def _flush_summaries(self, force=False):
+        """Queue one summary per recipient whose limit has capacity again"""
+        with self._overflow_lock:
+            keys = list(self._overflow)
+        for channel, recipient in keys:
+            if not force and not self._recipient_allows({'channel': channel, 'recipient': recipient}):
+                continue
+            with self._overflow_lock:
+                alerts = self._overflow.pop((channel, recipient), [])
+            if not alerts:
+                continue
+            first = min(alerts, key=alert_priority)
+            summary = {
+                'metric': 'summary',
+                'value': len(alerts),
+                'threshold': None,
+                'type': 'summary',
+                'severity': first['severity'],
+                'timestamp': datetime.now(),
+                'city': first.get('city'),
+                'suppressed': alerts,
+            }
+            item = {'channel': channel, 'alert': summary, 'recipient': recipient,
+                    'attempts': 0, 'summary': True}
+            self._track(1)
+            self._count(channel, 'summaries')
+            try:
+                self._put(item)
+            except queue.Full:
+                self._dead_letter(item, 'queue full for summary')
+
+    def _summary_loop(self):
+        while not self._stopping.wait(self.summary_interval):
+            self._flush_summaries()
+
+    # --- Bookkeeping ---
+    def _dead_letter(self, item, reason):
+        record = {
+            'failed_at': datetime.now().isoformat(),
+            'channel': item['channel'],
+            'recipient': item['recipient'],
+            'attempts': item['attempts'],
+            'reason': reason,
+            'alert': item['alert'],
+        }
+        with self._dead_letter_lock:
+            directory = os.path.dirname(self.dead_letter_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.dead_letter_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+        self._count(item['channel'], 'dead_lettered')
+        self._track(-1)
+
+    def _count(self, channel, key):
+        with self._stats_lock:
+            self.stats[channel][key] += 1
+
+    def _track(self, delta):
+        with self._idle:
+            self._outstanding += delta
+            if not self._outstanding:
+                self._idle.notify_all()
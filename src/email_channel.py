@@ -0,0 +1,315 @@
+"""
+email_channel.py
+Pooled SMTP mail dispatcher for climate alerts. Authenticated connections are kept
+open and reused across alerts, and alerts can optionally be coalesced per recipient
+into a digest over a short window.
+"""
+import os
+import time
+import queue
+import smtplib
+import logging
+import threading
+from datetime import datetime
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+EMAIL_USER = os.getenv('EMAIL_USER')
+EMAIL_PASS = os.getenv('EMAIL_PASS')
+SMTP_HOST = os.getenv('SMTP_HOST', 'smtp.gmail.com')
+SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
+# Seconds to coalesce a recipient's alerts into one digest email; 0 sends each alert at once
+EMAIL_DIGEST_WINDOW = float(os.getenv('EMAIL_DIGEST_WINDOW', 0))
+
+logger = logging.getLogger(__name__)
+
+
+def format_alert_email(alert):
+    """Subject and body for a single alert"""
+    if alert.get('suppressed'):
+        # Rate-limit overflow summary from the dispatcher
+        return format_digest_email(alert['suppressed'])
+    subject = f"🚨 Climate Risk Alert - {alert['severity']}"
+    body = f"""
+            Climate Risk Alert
+
+            City: {alert.get('city', 'N/A')}
+            Metric: {alert['metric'].title()}
+            Current Value: {alert['value']}
+            Threshold: {alert['threshold']} ({alert['type']})
+            Severity: {alert['severity']}
+            Time: {alert['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}
+
+            Please take appropriate action.
+
+            Automated Climate Risk Prediction System
+            """
+    return subject, body
+
+
+def format_digest_email(alerts):
+    """Subject and body summarising several alerts in one message"""
+    severity = 'HIGH' if any(a['severity'] == 'HIGH' for a in alerts) else alerts[0]['severity']
+    subject = f"🚨 Climate Risk Digest - {len(alerts)} alerts ({severity})"
+    lines = []
+    for alert in alerts:
+        city = f"{alert['city']} " if alert.get('city') else ""
+        lines.append(f"- [{alert['severity']}] {city}{alert['metric'].title()}: {alert['value']} "
+                     f"(threshold {alert['threshold']}, {alert['type']}) at "
+                     f"{alert['timestamp'].strftime('%Y-%m-%d %H:%M:%S')}")
+    body = "Climate Risk Alert Digest\n\n" + "\n".join(lines) + \
+        "\n\nPlease take appropriate action.\n\nAutomated Climate Risk Prediction System\n"
+    return subject, body
+
+
+def digest_alert(alerts):
+    """One alert carrying a whole digest, in the shape of the dispatcher's overflow summaries"""
+    first = next((a for a in alerts if a['severity'] == 'HIGH'), alerts[0])
+    return {
+        'metric': 'digest',
+        'value': len(alerts),
+        'threshold': None,
+        'type': 'digest',
+        'severity': first['severity'],
+        'timestamp': datetime.now(),
+        'city': first.get('city'),
+        'suppressed': alerts,
+    }
+
+
+class SMTPMailer:
+    """
+    Keeps up to pool_size authenticated SMTP connections and reuses them across sends.
+    on_failure(recipient, alerts, error) takes over digests that fail to send; without it
+    they are re-queued for the next flush.
+    """
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, user=EMAIL_USER, password=EMAIL_PASS,
+                 sender=None, pool_size=2, use_tls=True, timeout=30, digest_window=0,
+                 on_failure=None):
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.sender = sender or user
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.digest_window = digest_window
+        self.on_failure = on_failure
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._flusher = None
+        self._stopped = threading.Event()
+
+    # --- Connection pool ---
+    def _connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            server.starttls()
+        if self.user and self.password:
+            server.login(self.user, self.password)
+        return server
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            try:
+                return self._connect()
+            except Exception:
+                self._slots.release()
+                raise
+
+    def _release(self, server, broken=False):
+        if broken:
+            try:
+                server.close()
+            except Exception:
+                pass
+        else:
+            self._idle.put(server)
+        self._slots.release()
+
+    def send_message(self, recipient, subject, body):
+        """Send one plain-text message, reconnecting once if a pooled connection went stale"""
+        msg = MIMEMultipart()
+        msg['From'] = self.sender
+        msg['To'] = recipient
+        msg['Subject'] = subject
+        msg.attach(MIMEText(body, 'plain'))
+        text = msg.as_string()
+
+        for attempt in range(2):
+            server = self._acquire()
+            try:
+                server.sendmail(self.sender, recipient, text)
+            except (smtplib.SMTPServerDisconnected, ConnectionError):
+                self._release(server, broken=True)
+                if attempt == 1:
+                    raise
+                continue
+            except Exception:
+                self._release(server, broken=True)
+                raise
+            self._release(server)
+            return
+
+    def send_alert(self, alert, recipient):
+        """Send a single alert immediately"""
+        self.send_message(recipient, *format_alert_email(alert))
+
+    # --- Digests ---
+    def queue_alert(self, alert, recipient):
+        """Coalesce an alert into the recipient's digest (sent immediately when digests are off)"""
+        if not self.digest_window:
+            self.send_alert(alert, recipient)
+            return
+        with self._pending_lock:
+            self._pending.setdefault(recipient, (time.monotonic(), []))[1].append(alert)
+        self._ensure_flusher()
+
+    def flush_digests(self, force=False):
+        """
+        Send every digest whose window has elapsed (or all of them when force=True).
+        A failed send does not hold back the other recipients' digests.
+        """
+        now = time.monotonic()
+        with self._pending_lock:
+            due = [r for r, (first_seen, _) in self._pending.items()
+                   if force or now - first_seen >= self.digest_window]
+            batches = {r: self._pending.pop(r)[1] for r in due}
+        sent = 0
+        for recipient, alerts in batches.items():
+            try:
+                if len(alerts) == 1:
+                    self.send_alert(alerts[0], recipient)
+                else:
+                    self.send_message(recipient, *format_digest_email(alerts))
+            except Exception as e:
+                self._digest_failed(recipient, alerts, e, force)
+                continue
+            sent += 1
+        return sent
+
+    def _digest_failed(self, recipient, alerts, error, force):
+        if self.on_failure is not None:
+            try:
+                self.on_failure(recipient, alerts, error)
+                return
+            except Exception as e:
+                logger.error(f"Email digest failure handler raised for {recipient}: {e}")
+        if force:
+            logger.error(f"Email digest of {len(alerts)} alert(s) to {recipient} lost: {error}")
+            return
+        logger.warning(f"Email digest to {recipient} failed, retrying next window: {error}")
+        with self._pending_lock:
+            pending = self._pending.setdefault(recipient, (time.monotonic(), []))[1]
+            pending[:0] = alerts
+
+    def _ensure_flusher(self):
+        with self._pending_lock:
+            if self._flusher is None or not self._flusher.is_alive():
+                self._flusher = threading.Thread(target=self._flush_loop, args=(self._stopped,),
+                                                 daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self, stopped):
+        interval = max(self.digest_window / 4, 0.05)
+        while not stopped.wait(interval):
+            try:
+                self.flush_digests()
+            except Exception as e:
+                logger.error(f"Email digest flush failed: {e}")
+
+    def close(self):
+        """
+        Flush outstanding digests and close pooled connections; the mailer stays usable.
+        Never raises, since it runs at shutdown.
+        """
+        with self._pending_lock:
+            stopped, self._stopped = self._stopped, threading.Event()
+            flusher, self._flusher = self._flusher, None
+        stopped.set()
+        if flusher is not None:
+            flusher.join()
+        try:
+            self.flush_digests(force=True)
+        except Exception as e:
+            logger.error(f"Email digest flush at close failed: {e}")
+        while True:
+            try:
+                server = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                server.quit()
+            except Exception:
+                pass
+
+
+_default_mailer = None
+_default_mailer_lock = threading.Lock()
+
+
+def get_mailer():
+    """Process-wide mailer shared by ClimateAlertSystem"""
+    global _default_mailer
+    with _default_mailer_lock:
+        if _default_mailer is None:
+            _default_mailer = SMTPMailer(digest_window=EMAIL_DIGEST_WINDOW)
+        return _default_mailer
+
+
+def close_mailer():
+    """At process exit: send pending digests and close the shared mailer's connections"""
+    global _default_mailer
+    with _default_mailer_lock:
+        mailer, _default_mailer = _default_mailer, None
+    if mailer is not None:
+        mailer.close()
+
+
+def benchmark_mailer(n_alerts=500, digest_window=0):
+    """Throughput of the pooled mailer against a local aiosmtpd stand-in"""
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.handlers import Sink
+
+    controller = Controller(Sink(), hostname='127.0.0.1', port=8025)
+    controller.start()
+    try:
+        alert = {'metric': 'temperature', 'value': 42, 'threshold': 40, 'type': 'high',
+                 'severity': 'HIGH', 'timestamp': datetime.now(), 'city': 'Delhi'}
+
+        start = time.perf_counter()
+        for i in range(min(n_alerts, 50)):
+            server = smtplib.SMTP('127.0.0.1', 8025)
+            server.sendmail('alerts@localhost', f'user{i % 10}@localhost', 'Subject: x\n\nx')
+            server.quit()
+        per_connection = min(n_alerts, 50) / (time.perf_counter() - start)
+
+        mailer = SMTPMailer('127.0.0.1', 8025, user=None, password=None, sender='alerts@localhost',
+                            use_tls=False, digest_window=digest_window)
+        start = time.perf_counter()
+        for i in range(n_alerts):
+            mailer.queue_alert(alert, f'user{i % 10}@localhost')
+        mailer.close()
+        pooled = n_alerts / (time.perf_counter() - start)
+        print(f"Connection per alert: {per_connection:,.0f} alerts/s")
+        print(f"Pooled mailer (digest_window={digest_window}s): {pooled:,.0f} alerts/s")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    import sys
+
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark_mailer(n)
+        benchmark_mailer(n, digest_window=1)
@@ -0,0 +1,233 @@
+"""
+ensemble.py
+Ensemble forecasting that combines Prophet, exponential smoothing and seasonal naive
+members with weights learned from a backtest. Members fit in parallel and their
+forecasts are cached on disk (least recently used files pruned past a cap), so changing
+weights never triggers a refit. Like forecast_prophet, the result covers the training
+history as well as the horizon.
+"""
+import os
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import joblib
+from sklearn.metrics import mean_absolute_error
+from modeling import (train_prophet, prepare_series, load_best_params, apply_training_window,
+                      DEFAULT_TRAINING_WINDOW)
+
+ENSEMBLE_CACHE_DIR = "data/ensemble_cache"
+ENSEMBLE_CACHE_MAX_FILES = 256
+CACHE_FORMAT = 2       # bump when the cached frames change shape
+ENGINES = ['prophet', 'exp_smoothing', 'seasonal_naive']
+SEASON_LENGTH = 24     # hours in the daily cycle
+INTERVAL_Z = 1.2816    # 80% interval, matching Prophet's default interval_width
+BACKTEST_HOURS = 24    # holdout used to learn member weights
+
+
+def _hourly(series):
+    """Resample a ds/y frame onto an hourly grid, interpolating gaps"""
+    hourly = series.set_index('ds')['y'].resample('h').mean()
+    return hourly.interpolate(method='time').dropna()
+
+
+def _future_index(series, periods):
+    """Hourly timestamps following the last observation, as forecast_prophet produces"""
+    return pd.date_range(series['ds'].max(), periods=periods + 1, freq='h')[1:]
+
+
+def _history_ds(series):
+    """The history rows forecast_prophet returns: the Prophet member's windowed training data"""
+    return apply_training_window(series, DEFAULT_TRAINING_WINDOW)['ds']
+
+
+def _interval_frame(ds, yhat, sigma):
+    return pd.DataFrame({
+        'ds': ds,
+        'yhat': yhat,
+        'yhat_lower': yhat - INTERVAL_Z * sigma,
+        'yhat_upper': yhat + INTERVAL_Z * sigma,
+    })
+
+
+def _member_frame(series, hourly, fitted, fitted_sigma, yhat, sigma, periods):
+    """
+    History rows (in-sample fits on the hourly grid, interpolated onto the history
+    timestamps) followed by the forecast horizon
+    """
+    history = _history_ds(series)
+    grid = hourly.index.values.astype('int64')
+    history_yhat = np.interp(history.values.astype('datetime64[ns]').astype('int64'), grid, fitted)
+    return pd.concat([_interval_frame(history.values, history_yhat, fitted_sigma),
+                      _interval_frame(_future_index(series, periods), yhat, sigma)],
+                     ignore_index=True)
+
+
+def _prophet_member(series, target, city, periods):
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    train_df = series.rename(columns={'ds': 'timestamp', 'y': target}).assign(city=city)
+    model = train_prophet(train_df, target, city, window=DEFAULT_TRAINING_WINDOW,
+                          params=load_best_params(city, target))
+    rows = pd.DataFrame({'ds': np.concatenate([model.history['ds'].values,
+                                               _future_index(series, periods).values])})
+    return model.predict(rows)[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
+
+
+def _exp_smoothing_member(series, periods, alpha=0.3, beta=0.01, gamma=0.1):
+    """Additive Holt-Winters with a daily season"""
+    hourly = _hourly(series)
+    y = hourly.values
+    m = SEASON_LENGTH
+    if len(y) < 2 * m:
+        return _seasonal_naive_member(series, periods)
+
+    level = y[:m].mean()
+    trend = (y[m:2 * m].mean() - y[:m].mean()) / m
+    season = list(y[:m] - level)
+    fitted = list(y[:m])  # the first season initialises the state
+    residuals = []
+    for t in range(m, len(y)):
+        s = season[t - m]
+        fitted.append(level + trend + s)
+        residuals.append(y[t] - fitted[-1])
+        prev_level = level
+        level = alpha * (y[t] - s) + (1 - alpha) * (level + trend)
+        trend = beta * (level - prev_level) + (1 - beta) * trend
+        season.append(gamma * (y[t] - level) + (1 - gamma) * s)
+
+    h = np.arange(1, periods + 1)
+    seasonal = np.array([season[len(y) - m + (k - 1) % m] for k in h])
+    yhat = level + h * trend + seasonal
+    sigma = np.std(residuals) * np.sqrt(h)
+    return _member_frame(series, hourly, np.array(fitted), np.std(residuals), yhat, sigma, periods)
+
+
+def _seasonal_naive_member(series, periods):
+    """Repeat the last observed day"""
+    hourly = _hourly(series)
+    y = hourly.values
+    m = min(SEASON_LENGTH, len(y))
+    h = np.arange(1, periods + 1)
+    yhat = np.array([y[len(y) - m + (k - 1) % m] for k in h])
+    diffs = y[m:] - y[:-m] if len(y) > m else np.array([0.0])
+    sigma = np.std(diffs) * np.sqrt(np.ceil(h / m))
+    fitted = np.concatenate([y[:m], y[:-m]]) if len(y) > m else y
+    return _member_frame(series, hourly, fitted, np.std(diffs), yhat, sigma, periods)
+
+
+def _fit_member(engine, series, target, city, periods):
+    """Fit one ensemble member and forecast the horizon (runs in a worker)"""
+    if engine == 'prophet':
+        return _prophet_member(series, target, city, periods)
+    if engine == 'exp_smoothing':
+        return _exp_smoothing_member(series, periods)
+    if engine == 'seasonal_naive':
+        return _seasonal_naive_member(series, periods)
+    raise ValueError(f"Unknown ensemble engine: {engine}")
+
+
+def _cache_path(engine, series, target, city, periods):
+    """Member forecasts are keyed by the exact training data they were fit on"""
+    digest = hashlib.sha1(pd.util.hash_pandas_object(series, index=False).values.tobytes())
+    digest.update(f"{engine}|{target}|{city}|{periods}|{CACHE_FORMAT}".encode())
+    return os.path.join(ENSEMBLE_CACHE_DIR, f"{city}_{target}_{engine}_{digest.hexdigest()[:16]}.joblib")
+
+
+def prune_cache(max_files=ENSEMBLE_CACHE_MAX_FILES, cache_dir=ENSEMBLE_CACHE_DIR):
+    """Delete the least recently used member forecasts beyond max_files; returns the number removed"""
+    if not os.path.isdir(cache_dir):
+        return 0
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith('.joblib')]
+    if len(entries) <= max_files:
+        return 0
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[max_files:]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return len(entries) - max_files
+
+
+def member_forecasts(series, target, city, periods, engines=ENGINES, executor=None):
+    """Forecast each member, reusing cached forecasts and fitting the rest in parallel"""
+    os.makedirs(ENSEMBLE_CACHE_DIR, exist_ok=True)
+    forecasts, pending = {}, {}
+    for engine in engines:
+        path = _cache_path(engine, series, target, city, periods)
+        if os.path.exists(path):
+            forecasts[engine] = joblib.load(path)
+            os.utime(path)  # mark as recently used for prune_cache
+        else:
+            pending[engine] = path
+
+    if pending:
+        own_executor = executor is None
+        executor = executor or ProcessPoolExecutor(max_workers=len(pending))
+        try:
+            futures = {engine: executor.submit(_fit_member, engine, series, target, city, periods)
+                       for engine in pending}
+            for engine, future in futures.items():
+                forecasts[engine] = future.result()
+                joblib.dump(forecasts[engine], pending[engine])
+        finally:
+            if own_executor:
+                executor.shutdown()
+        prune_cache()
+    return forecasts
+
+
+def learn_weights(series, target, city, engines=ENGINES, holdout_hours=BACKTEST_HOURS, executor=None):
+    """Inverse-MAE weights from a backtest on the last holdout_hours of history"""
+    cutoff = series['ds'].max() - pd.Timedelta(hours=holdout_hours)
+    train = series[series['ds'] <= cutoff]
+    holdout = series[series['ds'] > cutoff]
+    backtests = member_forecasts(train, target, city, holdout_hours, engines, executor)
+
+    maes = {}
+    for engine, forecast in backtests.items():
+        horizon = forecast[forecast['ds'] > train['ds'].max()]
+        matched = pd.merge_asof(holdout.sort_values('ds'), horizon[['ds', 'yhat']].sort_values('ds'),
+                                on='ds', direction='nearest')
+        maes[engine] = mean_absolute_error(matched['y'], matched['yhat'])
+
+    inverse = {engine: 1.0 / max(mae, 1e-9) for engine, mae in maes.items()}
+    total = sum(inverse.values())
+    return {engine: value / total for engine, value in inverse.items()}
+
+
+def combine_forecasts(forecasts, weights):
+    """Weighted combination of member forecasts; member yhat columns are kept alongside"""
+    engines = [engine for engine in forecasts if weights.get(engine, 0) > 0]
+    if not engines:
+        raise ValueError(f"Ensemble weights {weights} give no member of {list(forecasts)} a positive weight")
+    total = sum(weights[engine] for engine in engines)
+    combined = forecasts[engines[0]][['ds']].copy().reset_index(drop=True)
+    for column in ['yhat', 'yhat_lower', 'yhat_upper']:
+        combined[column] = sum(weights[e] / total * forecasts[e][column].values for e in engines)
+    for engine, forecast in forecasts.items():
+        combined[f'yhat_{engine}'] = forecast['yhat'].values
+    return combined
+
+
+def forecast_ensemble(df, target, city, periods=24, engines=ENGINES, weights=None):
+    """
+    Ensemble forecast for the training history and the next `periods` hours, the same
+    rows as forecast_prophet. Returns its ds/yhat/yhat_lower/yhat_upper columns plus one
+    yhat_<engine> column per member. Pass `weights` to skip the backtest.
+    """
+    series = prepare_series(df, target, city).sort_values('ds').reset_index(drop=True)
+    with ProcessPoolExecutor(max_workers=len(engines)) as executor:
+        if weights is None:
+            weights = learn_weights(series, target, city, engines, executor=executor)
+        forecasts = member_forecasts(series, target, city, periods, engines, executor)
+    return combine_forecasts(forecasts, weights)
+
+
+if __name__ == "__main__":
+    df = pd.read_csv("data/combined_climate.csv")
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    forecast = forecast_ensemble(df, 'temperature', 'Delhi', periods=24)
+    print("Ensemble forecast for the next 24 hours:")
+    print(forecast.tail(10))
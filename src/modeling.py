@@ -2,24 +2,172 @@
 modeling.py
 Trains Prophet model for short-term climate forecasts. Optionally supports LSTM for advanced modeling.
 """
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
 import pandas as pd
 from prophet import Prophet
 import joblib
 from sklearn.metrics import mean_absolute_error
+import metrics
+from structured_logging import setup_logging
+
+# --- Training Windows ---
+# Each policy bounds how much history a fit sees:
+#   recent_days      keep the last N days at full resolution
+#   downsample_older aggregate rows older than recent_days to daily means
+#                    (instead of dropping them)
+#   max_rows         hard cap, keeping the most recent rows
+TRAINING_WINDOWS = {
+    'full': {},
+    'recent_14d': {'recent_days': 14},
+    'recent_14d_daily_older': {'recent_days': 14, 'downsample_older': True},
+    'cap_2000': {'max_rows': 2000},
+}
+DEFAULT_TRAINING_WINDOW = 'recent_14d_daily_older'
+
+# Best Prophet settings per series, written by tuning.py
+BEST_PARAMS_PATH = "data/tuning/best_params.json"
+
+FIT_SECONDS = metrics.histogram('climate_model_fit_duration_seconds', "Prophet fit time", ['metric'])
+TRAINING_ROWS = metrics.gauge('climate_model_training_rows', "Rows in the latest fit after windowing",
+                              ['city', 'metric'])
+FORECAST_SECONDS = metrics.histogram('climate_model_forecast_duration_seconds', "Prophet predict time")
+FOURIER_CACHE_LOOKUPS = metrics.counter('climate_fourier_cache_lookups_total',
+                                        "Fourier feature cache lookups", ['result'])
+FOURIER_CACHE_BYTES = metrics.gauge('climate_fourier_cache_bytes', "Memory held by cached Fourier features")
+
+# Memory budget for cached seasonality matrices (per process)
+FOURIER_CACHE_MAX_MB = float(os.getenv('FOURIER_CACHE_MAX_MB', 64))
+
+
+def apply_training_window(df_city, window=None):
+    """Trim a prepared ds/y frame according to a training window policy"""
+    if window is None:
+        return df_city
+    if isinstance(window, str):
+        window = TRAINING_WINDOWS[window]
+
+    df_city = df_city.sort_values('ds')
+    recent_days = window.get('recent_days')
+    if recent_days:
+        cutoff = df_city['ds'].max() - pd.Timedelta(days=recent_days)
+        recent = df_city[df_city['ds'] >= cutoff]
+        if window.get('downsample_older'):
+            older = df_city[df_city['ds'] < cutoff]
+            older = (older.set_index('ds')['y']
+                     .resample('D').mean()
+                     .dropna()
+                     .reset_index())
+            df_city = pd.concat([older, recent[['ds', 'y']]], ignore_index=True)
+        else:
+            df_city = recent
+
+    max_rows = window.get('max_rows')
+    if max_rows and len(df_city) > max_rows:
+        df_city = df_city.iloc[-max_rows:]
+
+    return df_city.reset_index(drop=True)
+
+
+# --- Shared Fourier Feature Cache ---
+class FourierFeatureCache:
+    """
+    LRU cache of Fourier seasonality matrices keyed by (timestamps, period, order),
+    bounded by the bytes it holds. Each process has its own; tuning and ensemble
+    workers warm theirs independently.
+    """
+
+    def __init__(self, max_bytes=int(FOURIER_CACHE_MAX_MB * 1024 * 1024)):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(dates, period, series_order):
+        values = dates.values.astype('datetime64[ns]').view('int64')
+        return (hashlib.sha1(values.tobytes()).hexdigest(), len(values), str(dates.dt.tz), float(period), int(series_order))
+
+    def get(self, dates, period, series_order, compute):
+        key = self._key(dates, period, series_order)
+        with self._lock:
+            features = self._entries.get(key)
+            if features is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                FOURIER_CACHE_LOOKUPS.labels('hit').inc()
+                return features.copy()
+            self.misses += 1
+        FOURIER_CACHE_LOOKUPS.labels('miss').inc()
+        features = compute(dates, period, series_order)
+        if features.nbytes <= self.max_bytes:
+            with self._lock:
+                if key not in self._entries:
+                    self._entries[key] = features
+                    self.nbytes += features.nbytes
+                while self.nbytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+                FOURIER_CACHE_BYTES.set(self.nbytes)
+        return features.copy()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'mb': round(self.nbytes / (1024 * 1024), 2),
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.nbytes = 0
+            FOURIER_CACHE_BYTES.set(0)
+
+
+FOURIER_CACHE = FourierFeatureCache()
+
+
+class CachedProphet(Prophet):
+    """Prophet whose seasonality features come from the shared FOURIER_CACHE"""
+
+    @staticmethod
+    def fourier_series(dates, period, series_order):
+        return FOURIER_CACHE.get(dates, period, series_order, Prophet.fourier_series)
+
 
 # --- Prophet Modeling ---
-def train_prophet(df, target, city):
-    # Prepare data for Prophet
+def prepare_series(df, target, city):
+    """Select one city's target column as a Prophet ds/y frame"""
     df_city = df[df['city'] == city].copy()
     df_city = df_city.dropna(subset=[target])
     df_city.rename(columns={'timestamp': 'ds', target: 'y'}, inplace=True)
-    model = Prophet()
-    model.fit(df_city[['ds', 'y']])
+    return df_city[['ds', 'y']]
+
+
+def train_prophet(df, target, city, window=None, params=None):
+    # Prepare data for Prophet
+    df_city = apply_training_window(prepare_series(df, target, city), window)
+    model = CachedProphet(**(params or {}))
+    with FIT_SECONDS.labels(target).time():
+        model.fit(df_city[['ds', 'y']])
+    TRAINING_ROWS.labels(city, target).set(len(df_city))
     return model
 
 def forecast_prophet(model, periods=24):
     future = model.make_future_dataframe(periods=periods, freq='H')
-    forecast = model.predict(future)
+    with FORECAST_SECONDS.time():
+        forecast = model.predict(future)
     return forecast[['ds', 'yhat', 'yhat_lower', 'yhat_upper']]
 
 def evaluate_model(model, df_city):
@@ -30,19 +178,106 @@ def evaluate_model(model, df_city):
     mae = mean_absolute_error(y_true, y_pred)
     return mae
 
+def compare_training_windows(df, target, city, windows=None, holdout_hours=24):
+    """Report fit time and holdout MAE for each training window policy"""
+    series = prepare_series(df, target, city).sort_values('ds')
+    split = series['ds'].max() - pd.Timedelta(hours=holdout_hours)
+    train, holdout = series[series['ds'] <= split], series[series['ds'] > split]
+    train_df = train.rename(columns={'ds': 'timestamp', 'y': target}).assign(city=city)
+
+    results = []
+    for name in (windows or TRAINING_WINDOWS):
+        start = time.perf_counter()
+        model = train_prophet(train_df, target, city, window=name)
+        fit_seconds = time.perf_counter() - start
+        mae = None
+        if len(holdout):
+            forecast = model.predict(holdout[['ds']])
+            mae = mean_absolute_error(holdout['y'].values, forecast['yhat'].values)
+        results.append({
+            'window': name,
+            'rows': len(model.history),
+            'fit_seconds': round(fit_seconds, 3),
+            'holdout_mae': mae,
+        })
+    return pd.DataFrame(results)
+
+def benchmark_fourier_cache(df, city, targets=('temperature', 'humidity', 'aqi', 'rainfall'),
+                            periods=24, rounds=3):
+    """
+    End-to-end fit and forecast time for every metric of a city with plain Prophet and
+    with CachedProphet. The metrics share timestamps, so after the first metric every
+    training-time seasonality matrix is a cache hit; later rounds stand in for the
+    scheduler re-training on unchanged data.
+    """
+    series = [prepare_series(df, target, city) for target in targets]
+    results = []
+    for name, model_class in (('Prophet', Prophet), ('CachedProphet', CachedProphet)):
+        FOURIER_CACHE.clear()
+        fourier_seconds = [0.0]
+
+        def timed_fourier(dates, period, series_order, compute=Prophet.fourier_series):
+            start = time.perf_counter()
+            try:
+                return compute(dates, period, series_order)
+            finally:
+                fourier_seconds[0] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        original, Prophet.fourier_series = Prophet.fourier_series, staticmethod(timed_fourier)
+        try:
+            for _ in range(rounds):
+                for df_city in series:
+                    model = model_class()
+                    model.fit(df_city)
+                    model.predict(model.make_future_dataframe(periods=periods, freq='h'))
+        finally:
+            Prophet.fourier_series = staticmethod(original)
+        results.append({
+            'model': name,
+            'fits': rounds * len(series),
+            'total_seconds': round(time.perf_counter() - start, 3),
+            'fourier_seconds': round(fourier_seconds[0], 3),
+            'cache_hits': FOURIER_CACHE.hits,
+            'cache_misses': FOURIER_CACHE.misses,
+        })
+    return pd.DataFrame(results)
+
+def load_best_params(city, target, path=BEST_PARAMS_PATH):
+    """Return tuned Prophet parameters for a series, or None if it was never tuned"""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        best = json.load(f)
+    entry = best.get(f"{city}|{target}")
+    return entry['params'] if entry else None
+
 def save_model(model, filename):
     joblib.dump(model, filename)
-    print(f"Model saved to {filename}")
+    logging.getLogger(__name__).info(f"Model saved to {filename}")
 
 def load_model(filename):
     return joblib.load(filename)
 
 if __name__ == "__main__":
+    import sys
+
+    setup_logging(log_path=None)
     df = pd.read_csv("data/combined_climate.csv")
     df['timestamp'] = pd.to_datetime(df['timestamp'])
     target = 'temperature'  # You can change to 'humidity', 'rainfall', or 'aqi'
     city = 'Delhi'  # Example city
     
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-cache":
+        # Wall time saved by the shared Fourier feature cache across a city's metrics
+        print(benchmark_fourier_cache(df, city).to_string(index=False))
+        sys.exit(0)
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "--compare-windows":
+        # Fit time and holdout accuracy under each training window policy
+        print(compare_training_windows(df, target, city).to_string(index=False))
+        sys.exit(0)
+    
     print(f"Training Prophet model for {target} in {city}")
     print(f"Dataset shape: {df.shape}")
     print(f"Available data points for {city}: {len(df[df['city'] == city])}")
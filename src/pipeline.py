@@ -0,0 +1,409 @@
+"""
+pipeline.py
+Small dependency-aware DAG executor for the automation pipeline. Stages declare the
+stages they depend on and start as soon as all of them have succeeded, so independent
+work (e.g. per-city training and alert checks) runs concurrently on a thread pool.
+A stage fails when it raises, returns False or leaves a declared output missing;
+everything downstream is skipped.
+
+Stages that declare their input files (and optionally config and output files) are
+cached make-style: a fingerprint of the input contents and config is recorded after
+each success, and the stage is skipped while the fingerprint is unchanged and its
+outputs still exist.
+
+Every run also writes a checkpoint (data/runs/<pipeline>/<run id>.json) with each
+stage's outcome and artifacts. A failed run can be resumed: stages that completed and
+whose artifacts are still on disk are not run again. Run and stage timings, row counts
+and peak RSS go to the run history store (run_history.py); a stage reports rows
+processed by returning an int. Log records carry the run ID, pipeline and stage.
+"""
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import threading
+import contextvars
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from run_history import RunHistory, RUN_HISTORY_PATH, current_rss_mb
+from structured_logging import log_context
+import metrics
+
+PIPELINE_CACHE_PATH = "data/pipeline_cache.json"
+CHECKPOINT_DIR = "data/runs"
+KEEP_RUNS = 50  # checkpoints kept per pipeline
+
+SUCCEEDED = 'succeeded'
+CACHED = 'cached'
+RESUMED = 'resumed'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+DONE = (SUCCEEDED, CACHED, RESUMED)
+
+STAGE_SECONDS = metrics.histogram('climate_pipeline_stage_duration_seconds', "Stage run time",
+                                  ['pipeline', 'stage'])
+STAGE_RESULTS = metrics.counter('climate_pipeline_stage_results_total', "Stage outcomes",
+                                ['pipeline', 'stage', 'state'])
+STAGE_ROWS = metrics.counter('climate_pipeline_stage_rows_total', "Rows processed by stages",
+                             ['pipeline', 'stage'])
+PIPELINE_RUNS = metrics.counter('climate_pipeline_runs_total', "Pipeline runs", ['pipeline', 'status'])
+LAST_SUCCESS = metrics.gauge('climate_pipeline_last_success_timestamp_seconds',
+                             "Unix time of the last successful run", ['pipeline'])
+
+
+class Stage:
+    """One unit of pipeline work"""
+
+    def __init__(self, name, func, deps=(), inputs=None, outputs=(), config=None):
+        self.name = name
+        self.func = func
+        self.deps = list(deps)
+        # Input paths (or a callable returning them); None means the stage always runs
+        self.inputs = inputs
+        self.outputs = list(outputs)
+        self.config = config or {}
+
+    @property
+    def cacheable(self):
+        return self.inputs is not None
+
+
+def new_run_id():
+    return f"{datetime.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class StageCache:
+    """Last successful fingerprint per stage, persisted as JSON"""
+
+    def __init__(self, path=PIPELINE_CACHE_PATH):
+        self.path = path
+        self.entries = {}
+        self._digests = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def file_digest(self, path):
+        """sha256 of a file's contents, memoised on (size, mtime) so each file is read once"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 'missing'
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            sha = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    sha.update(block)
+            digest = self._digests[key] = sha.hexdigest()
+        return digest
+
+    def fingerprint(self, stage):
+        inputs = stage.inputs() if callable(stage.inputs) else stage.inputs
+        record = {
+            'config': stage.config,
+            'inputs': {path: self.file_digest(path) for path in sorted(inputs)},
+        }
+        return hashlib.sha256(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+    def is_fresh(self, stage, fingerprint):
+        entry = self.entries.get(stage.name)
+        return (entry is not None and entry['fingerprint'] == fingerprint and
+                all(os.path.exists(path) for path in stage.outputs))
+
+    def record(self, stage, fingerprint):
+        with self._lock:
+            self.entries[stage.name] = {'fingerprint': fingerprint,
+                                        'completed_at': time.strftime('%Y-%m-%dT%H:%M:%S')}
+            _write_json(self.path, self.entries)
+
+
+class RunCheckpoint:
+    """Per-run record of stage outcomes and artifacts, rewritten after every stage"""
+
+    def __init__(self, path, record):
+        self.path = path
+        self.record = record
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, pipeline_name, directory=CHECKPOINT_DIR):
+        run_id = new_run_id()
+        record = {'run_id': run_id, 'pipeline': pipeline_name, 'status': 'running',
+                  'started_at': datetime.now().isoformat(), 'finished_at': None,
+                  'resumed_from': None, 'stages': {}}
+        checkpoint = cls(os.path.join(directory, pipeline_name, f"{run_id}.json"), record)
+        checkpoint.save()
+        cls._prune(os.path.join(directory, pipeline_name))
+        return checkpoint
+
+    @staticmethod
+    def _prune(run_dir, keep=KEEP_RUNS):
+        runs = sorted(name for name in os.listdir(run_dir) if name.endswith('.json'))
+        for name in runs[:-keep]:
+            os.remove(os.path.join(run_dir, name))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls(path, json.load(f))
+
+    @classmethod
+    def latest(cls, pipeline_name, directory=CHECKPOINT_DIR):
+        """Most recent run of a pipeline, or None"""
+        run_dir = os.path.join(directory, pipeline_name)
+        if not os.path.isdir(run_dir):
+            return None
+        runs = sorted(name for name in os.listdir(run_dir) if name.endswith('.json'))
+        return cls.load(os.path.join(run_dir, runs[-1])) if runs else None
+
+    @property
+    def run_id(self):
+        return self.record['run_id']
+
+    @property
+    def status(self):
+        return self.record['status']
+
+    @property
+    def started_at(self):
+        return datetime.fromisoformat(self.record['started_at'])
+
+    def completed(self, name):
+        """True if the stage finished in this run and its artifacts still exist"""
+        entry = self.record['stages'].get(name)
+        return (entry is not None and entry['state'] in DONE and
+                all(os.path.exists(path) for path in entry['artifacts']))
+
+    def inherit(self, previous):
+        """Carry over the stages a previous run completed"""
+        self.record['resumed_from'] = previous.run_id
+        for name, entry in previous.record['stages'].items():
+            if previous.completed(name):
+                self.record['stages'][name] = dict(entry, run_id=entry.get('run_id', previous.run_id))
+        self.save()
+
+    def update(self, name, state, duration, artifacts):
+        with self._lock:
+            self.record['stages'][name] = {
+                'state': state,
+                'finished_at': datetime.now().isoformat(),
+                'duration_seconds': round(duration, 3),
+                # All declared outputs; completed() requires every one of them to exist
+                'artifacts': list(artifacts),
+                'run_id': self.run_id,
+            }
+            self.save()
+
+    def finish(self, status):
+        with self._lock:
+            self.record['status'] = status
+            self.record['finished_at'] = datetime.now().isoformat()
+            self.save()
+
+    def save(self):
+        _write_json(self.path, self.record)
+
+
+class Pipeline:
+    """DAG of stages executed with as much concurrency as the dependencies allow"""
+
+    def __init__(self, name="pipeline", max_workers=4, cache_path=PIPELINE_CACHE_PATH,
+                 checkpoint_dir=CHECKPOINT_DIR, history_path=RUN_HISTORY_PATH):
+        self.name = name
+        self.max_workers = max_workers
+        self.cache_path = cache_path
+        self.cache = None
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint = None
+        self.history_path = history_path
+        self.history = None
+        self.run_id = None
+        self.stages = {}
+        self.results = {}
+        self.durations = {}
+        self.rows = {}
+        self.logger = logging.getLogger(__name__)
+
+    def add(self, name, func, deps=(), inputs=None, outputs=(), config=None):
+        """
+        Register a stage; deps are names of stages that must succeed first. Declaring
+        inputs (file paths) makes the stage cacheable on their contents plus config.
+        """
+        if name in self.stages:
+            raise ValueError(f"Duplicate stage '{name}'")
+        self.stages[name] = Stage(name, func, deps, inputs, outputs, config)
+        return self
+
+    def order(self):
+        """Stage names in a valid execution order; raises ValueError on unknown deps or cycles"""
+        for stage in self.stages.values():
+            missing = [dep for dep in stage.deps if dep not in self.stages]
+            if missing:
+                raise ValueError(f"Stage '{stage.name}' depends on unknown stage(s) {missing}")
+        remaining = {name: set(stage.deps) for name, stage in self.stages.items()}
+        ordered = []
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"Dependency cycle among stages {sorted(remaining)}")
+            for name in ready:
+                ordered.append(name)
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+        return ordered
+
+    def _run_stage(self, stage, use_cache):
+        started_at = datetime.now()
+        rss_before = current_rss_mb()
+        with log_context(stage=stage.name):
+            state = self._execute_stage(stage, use_cache, time.perf_counter())
+        rss_after = current_rss_mb()
+        # Memory the stage left resident; stages running concurrently share the process
+        rss_delta = None if rss_before is None or rss_after is None else round(rss_after - rss_before, 1)
+        if state != CACHED:
+            STAGE_SECONDS.labels(self.name, stage.name).observe(self.durations[stage.name])
+        if stage.name in self.rows:
+            STAGE_ROWS.labels(self.name, stage.name).inc(self.rows[stage.name])
+        if self.history is not None:
+            self.history.record_stage(self.run_id, self.name, stage.name, started_at, datetime.now(),
+                                      self.durations[stage.name], state, self.rows.get(stage.name),
+                                      rss_delta)
+        return state
+
+    def _execute_stage(self, stage, use_cache, start):
+        fingerprint = None
+        if stage.cacheable and self.cache is not None:
+            fingerprint = self.cache.fingerprint(stage)
+            if use_cache and self.cache.is_fresh(stage, fingerprint):
+                self.durations[stage.name] = time.perf_counter() - start
+                self.logger.info(f"Stage {stage.name} cache hit, inputs unchanged")
+                return CACHED
+            self.logger.info(f"Stage {stage.name} cache miss")
+        self.logger.info(f"Stage {stage.name} started")
+        try:
+            result = stage.func()
+            ok = result is not False
+            if isinstance(result, int) and not isinstance(result, bool):
+                self.rows[stage.name] = result
+        except Exception as e:
+            self.logger.error(f"Stage {stage.name} raised: {e}")
+            ok = False
+        missing = [path for path in stage.outputs if not os.path.exists(path)] if ok else []
+        if missing:
+            self.logger.error(f"Stage {stage.name} did not produce {missing}")
+            ok = False
+        if ok and fingerprint is not None:
+            self.cache.record(stage, fingerprint)
+        self.durations[stage.name] = time.perf_counter() - start
+        return SUCCEEDED if ok else FAILED
+
+    def latest_run(self):
+        """Checkpoint of this pipeline's most recent run, or None"""
+        return RunCheckpoint.latest(self.name, self.checkpoint_dir) if self.checkpoint_dir else None
+
+    def run(self, use_cache=True, resume_from=None):
+        """
+        Execute every stage; returns {stage name: succeeded/cached/resumed/failed/skipped}.
+        use_cache=False re-runs every stage but still records fresh fingerprints.
+        resume_from is a RunCheckpoint whose completed stages are not run again.
+        """
+        self.order()
+        if self.cache is None and self.cache_path:
+            self.cache = StageCache(self.cache_path)
+        if self.history is None and self.history_path:
+            self.history = RunHistory(self.history_path)
+        if self.checkpoint_dir:
+            self.checkpoint = RunCheckpoint.create(self.name, self.checkpoint_dir)
+            self.run_id = self.checkpoint.run_id
+            if resume_from is not None:
+                self.checkpoint.inherit(resume_from)
+                self.logger.info(f"Run {self.run_id} resuming run {resume_from.run_id}",
+                                 extra={'run_id': self.run_id, 'pipeline': self.name})
+        else:
+            self.run_id = new_run_id()
+        with log_context(run_id=self.run_id, pipeline=self.name):
+            return self._run(use_cache, resume_from)
+
+    def _run(self, use_cache, resume_from):
+        if self.history is not None:
+            self.history.start_run(self.run_id, self.name, datetime.now())
+        self.results = {}
+        self.durations = {}
+        self.rows = {}
+        waiting = dict(self.stages)
+        running = {}
+        start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name) as pool:
+            while waiting or running:
+                for name, stage in list(waiting.items()):
+                    states = [self.results.get(dep) for dep in stage.deps]
+                    if any(state in (FAILED, SKIPPED) for state in states):
+                        self.results[name] = SKIPPED
+                        self.logger.warning(f"Stage {name} skipped: an upstream stage did not succeed",
+                                            extra={'stage': name})
+                        if self.checkpoint is not None:
+                            self.checkpoint.update(name, SKIPPED, 0.0, ())
+                        del waiting[name]
+                    elif (resume_from is not None and all(state == RESUMED for state in states)
+                          and self.checkpoint.completed(name)):
+                        # Completed in the run being resumed, and so was everything upstream
+                        self.results[name] = RESUMED
+                        self.logger.info(f"Stage {name} already completed, skipping", extra={'stage': name})
+                        del waiting[name]
+                    elif all(state in DONE for state in states):
+                        # Stage threads inherit the run's log context
+                        future = pool.submit(contextvars.copy_context().run, self._run_stage, stage, use_cache)
+                        running[future] = name
+                        del waiting[name]
+                if not running:
+                    continue  # only skips happened this pass; re-scan the waiting stages
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.results[name] = future.result()
+                    if self.checkpoint is not None:
+                        self.checkpoint.update(name, self.results[name], self.durations[name],
+                                               self.stages[name].outputs)
+                    if self.results[name] != CACHED:
+                        log = self.logger.error if self.results[name] == FAILED else self.logger.info
+                        log(f"Stage {name} {self.results[name]} in {self.durations[name]:.1f}s",
+                            extra={'stage': name, 'duration': self.durations[name]})
+
+        status = SUCCEEDED if self.succeeded else FAILED
+        for name, state in self.results.items():
+            STAGE_RESULTS.labels(self.name, name, state).inc()
+        PIPELINE_RUNS.labels(self.name, status).inc()
+        if status == SUCCEEDED:
+            LAST_SUCCESS.labels(self.name).set_to_current_time()
+        if self.checkpoint is not None:
+            self.checkpoint.finish(status)
+        if self.history is not None:
+            self.history.finish_run(self.run_id, datetime.now(), time.perf_counter() - start, status)
+        counts = {state: sum(s == state for s in self.results.values())
+                  for state in (SUCCEEDED, CACHED, RESUMED, FAILED, SKIPPED)}
+        elapsed = time.perf_counter() - start
+        self.logger.info(f"Pipeline {self.name} finished in {elapsed:.1f}s: "
+                         + ", ".join(f"{n} {state}" for state, n in counts.items() if n),
+                         extra={'duration': elapsed})
+        return self.results
+
+    @property
+    def succeeded(self):
+        return bool(self.results) and all(state in DONE for state in self.results.values())
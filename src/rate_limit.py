@@ -0,0 +1,66 @@
+"""
+rate_limit.py
+Thread-safe token bucket used to cap notification send rates.
+"""
+import time
+import threading
+
+
+class TokenBucket:
+    """Allows `rate` operations per second on average with bursts of up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        if self.rate <= 0 or self.capacity <= 0:
+            raise ValueError(f"TokenBucket needs a positive rate and capacity, got {rate} and {capacity}")
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _check(self, tokens):
+        if tokens > self.capacity:
+            raise ValueError(f"Cannot acquire {tokens} tokens from a bucket holding at most {self.capacity:g}")
+
+    def level(self):
+        """Tokens available now"""
+        with self._lock:
+            self._refill(time.monotonic())
+            return self.tokens
+
+    def set_level(self, tokens):
+        """Restore a saved level (clamped to 0..capacity), e.g. after a restart"""
+        with self._lock:
+            self.tokens = min(self.capacity, max(0.0, float(tokens)))
+            self.updated = time.monotonic()
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available without waiting"""
+        self._check(tokens)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Wait until tokens are available; returns False if timeout expires first"""
+        self._check(tokens)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return True
+                wait = (tokens - self.tokens) / self.rate
+            if deadline is not None:
+                if now + wait > deadline:
+                    return False
+            time.sleep(wait)
@@ -0,0 +1,203 @@
+"""
+run_history.py
+Structured history of pipeline runs and scheduled jobs in SQLite (WAL mode): one row
+per run with the process's peak RSS, and one per stage with start/end, duration, rows
+processed and the change in resident memory across the stage. The CLI report flags
+stages whose latest duration regressed against a rolling baseline.
+"""
+import os
+import sys
+import sqlite3
+import argparse
+import threading
+import pandas as pd
+
+RUN_HISTORY_PATH = "data/run_history.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    pipeline TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    duration_seconds REAL,
+    status TEXT NOT NULL,
+    process_peak_rss_mb REAL
+);
+CREATE TABLE IF NOT EXISTS stages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    pipeline TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    started_at TEXT NOT NULL,
+    finished_at TEXT NOT NULL,
+    duration_seconds REAL NOT NULL,
+    state TEXT NOT NULL,
+    rows INTEGER,
+    rss_delta_mb REAL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_pipeline_time ON runs (pipeline, started_at);
+CREATE INDEX IF NOT EXISTS idx_stages_stage_time ON stages (pipeline, stage, started_at);
+"""
+
+# Columns added after the first schema; older databases gain them on open
+MIGRATIONS = {
+    'runs': [('process_peak_rss_mb', 'REAL')],
+    'stages': [('rss_delta_mb', 'REAL')],
+}
+
+
+def current_rss_mb():
+    """Current resident set size of this process in MB, or None where it cannot be measured"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+    except ImportError:
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size over the whole process lifetime in MB, or None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024 * 1024), 1)
+    except ImportError:
+        return None
+
+
+class RunHistory:
+    """Append-only SQLite store of run and stage records"""
+
+    def __init__(self, path=RUN_HISTORY_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        with self._lock, self._conn:
+            for table, columns in MIGRATIONS.items():
+                existing = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+                for name, kind in columns:
+                    if name not in existing:
+                        self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {kind}")
+
+    def _execute(self, sql, params):
+        with self._lock, self._conn:
+            self._conn.execute(sql, params)
+
+    def start_run(self, run_id, pipeline, started_at):
+        self._execute("INSERT OR REPLACE INTO runs (run_id, pipeline, started_at, status) "
+                      "VALUES (?, ?, ?, 'running')", (run_id, pipeline, started_at.isoformat()))
+
+    def finish_run(self, run_id, finished_at, duration, status):
+        self._execute("UPDATE runs SET finished_at = ?, duration_seconds = ?, status = ?, "
+                      "process_peak_rss_mb = ? WHERE run_id = ?",
+                      (finished_at.isoformat(), duration, status, peak_rss_mb(), run_id))
+
+    def record_stage(self, run_id, pipeline, stage, started_at, finished_at, duration, state, rows=None,
+                     rss_delta_mb=None):
+        self._execute("INSERT INTO stages (run_id, pipeline, stage, started_at, finished_at, "
+                      "duration_seconds, state, rows, rss_delta_mb) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                      (run_id, pipeline, stage, started_at.isoformat(), finished_at.isoformat(),
+                       duration, state, rows, rss_delta_mb))
+
+    def runs(self, pipeline=None, limit=20):
+        """Most recent runs, newest first"""
+        sql = "SELECT * FROM runs"
+        params = []
+        if pipeline:
+            sql += " WHERE pipeline = ?"
+            params.append(pipeline)
+        sql += f" ORDER BY started_at DESC LIMIT {int(limit)}"
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    def stages(self, pipeline=None, state='succeeded'):
+        """Stage records oldest first, by default only stages that actually ran and succeeded"""
+        clauses, params = [], []
+        for column, value in (('pipeline', pipeline), ('state', state)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        sql = "SELECT * FROM stages"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY started_at"
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+    def regression_report(self, pipeline=None, window=10, threshold=1.5, min_seconds=1.0):
+        """
+        Latest duration of every stage against the median of its previous `window`
+        successful runs. Stages slower than threshold x baseline (and by at least
+        min_seconds) are flagged as regressed.
+        """
+        columns = ['pipeline', 'stage', 'runs', 'latest_seconds', 'baseline_seconds', 'ratio',
+                   'latest_rows', 'rss_delta_mb', 'regressed']
+        df = self.stages(pipeline)
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+        grouped = df.groupby(['pipeline', 'stage'])['duration_seconds']
+        # Median of the preceding `window` runs, excluding the run being judged
+        df['baseline_seconds'] = grouped.transform(
+            lambda durations: durations.shift().rolling(window, min_periods=1).median())
+        df['runs'] = grouped.transform('size')
+        latest = df.groupby(['pipeline', 'stage']).tail(1).copy()
+        latest = latest.rename(columns={'duration_seconds': 'latest_seconds', 'rows': 'latest_rows'})
+        latest['ratio'] = (latest['latest_seconds'] / latest['baseline_seconds']).round(2)
+        latest['regressed'] = ((latest['ratio'] >= threshold) &
+                               (latest['latest_seconds'] - latest['baseline_seconds'] >= min_seconds))
+        return latest.sort_values(['regressed', 'ratio'], ascending=False)[columns].reset_index(drop=True)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline run history and stage duration regressions")
+    parser.add_argument("--pipeline", help="limit to one pipeline or job:<name>")
+    parser.add_argument("--runs", type=int, default=10, help="number of recent runs to list")
+    parser.add_argument("--window", type=int, default=10, help="runs in the rolling baseline")
+    parser.add_argument("--threshold", type=float, default=1.5, help="slowdown ratio counted as a regression")
+    parser.add_argument("--path", default=RUN_HISTORY_PATH)
+    args = parser.parse_args()
+
+    history = RunHistory(args.path)
+    runs = history.runs(args.pipeline, args.runs)
+    print("Recent runs:")
+    print(runs.to_string(index=False) if not runs.empty else "  (none)")
+
+    report = history.regression_report(args.pipeline, args.window, args.threshold)
+    print(f"\nStage durations vs median of previous {args.window} runs:")
+    print(report.to_string(index=False) if not report.empty else "  (no completed stages)")
+    regressed = report[report['regressed'].astype(bool)]
+    if not regressed.empty:
+        print(f"\n{len(regressed)} stage(s) regressed: " +
+              ", ".join(f"{row.pipeline}/{row.stage} x{row.ratio}" for row in regressed.itertuples()))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
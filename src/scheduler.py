@@ -0,0 +1,283 @@
+"""
+scheduler.py
+Asyncio job scheduler for the automation pipeline. Jobs fire on cron expressions
+and/or named events (e.g. "data_landed"), sleep precisely until their next fire time,
+and run concurrently on a thread pool. Per-job concurrency limits and conflict lists
+stop a job from overlapping itself or the jobs it shares files with; a trigger that
+arrives while a conflicting job runs is deferred until that job finishes. Every job run
+is recorded in the run history as pipeline "job:<name>".
+"""
+import os
+import asyncio
+import signal
+import inspect
+import logging
+import contextvars
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from pipeline import new_run_id
+from run_history import RunHistory, RUN_HISTORY_PATH
+from structured_logging import log_context
+import metrics
+
+JOB_RUNS = metrics.counter('climate_job_runs_total', "Scheduled job runs", ['job', 'status'])
+JOB_SECONDS = metrics.histogram('climate_job_duration_seconds', "Scheduled job run time", ['job'])
+JOB_SKIPPED = metrics.counter('climate_job_skipped_total', "Job triggers dropped by concurrency limits",
+                              ['job'])
+JOBS_RUNNING = metrics.gauge('climate_jobs_running', "Jobs currently running", ['job'])
+
+CRON_FIELDS = (('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7))
+
+
+def _parse_field(spec, low, high):
+    values = set()
+    for part in spec.split(','):
+        step = 1
+        if '/' in part:
+            part, step = part.split('/')
+            step = int(step)
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = map(int, part.split('-'))
+        else:
+            start = end = int(part)
+            if step > 1:
+                end = high
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Cron field '{spec}' is outside {low}-{high}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class CronExpression:
+    """Standard 5-field cron (minute hour day month weekday; Sunday is 0 or 7)"""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression '{expression}' needs 5 fields")
+        self.expression = expression
+        parsed = [_parse_field(spec, low, high) for spec, (_, low, high) in zip(fields, CRON_FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self.weekdays = {day % 7 for day in weekdays}
+        # As in cron, a restricted day and weekday match when either one does
+        self.day_restricted = fields[2] != '*'
+        self.weekday_restricted = fields[4] != '*'
+
+    def _day_matches(self, dt):
+        weekday = (dt.weekday() + 1) % 7  # cron counts from Sunday
+        day_ok, weekday_ok = dt.day in self.days, weekday in self.weekdays
+        if self.day_restricted and self.weekday_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+    def next_after(self, dt):
+        """First matching minute strictly after dt"""
+        dt = dt.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = dt + timedelta(days=366 * 5)
+        while dt < limit:
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+
+class Job:
+    """A scheduled callable and its triggers"""
+
+    def __init__(self, name, func, cron=None, events=(), max_concurrency=1, conflicts=(),
+                 emits=None, run_on_start=False):
+        self.name = name
+        self.func = func
+        self.cron = CronExpression(cron) if cron else None
+        self.events = set(events)
+        self.max_concurrency = max_concurrency
+        self.conflicts = set(conflicts)
+        # Event fired after every successful run (a run succeeds unless it raises or returns False)
+        self.emits = emits
+        self.run_on_start = run_on_start
+        self.running = 0
+        self.runs = 0
+        self.skipped = 0
+        # Reason of a trigger held back by a conflicting job; at most one is kept
+        self.deferred = None
+
+
+class Scheduler:
+    """Runs jobs on cron and event triggers with per-job concurrency limits"""
+
+    def __init__(self, max_workers=4, history_path=RUN_HISTORY_PATH):
+        self.jobs = {}
+        self.history = RunHistory(history_path) if history_path else None
+        self.watches = []
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.logger = logging.getLogger(__name__)
+        self._loop = None
+        self._stopping = None
+        self._tasks = set()
+
+    def add_job(self, name, func, cron=None, events=(), max_concurrency=1, conflicts=(),
+                emits=None, run_on_start=False):
+        if name in self.jobs:
+            raise ValueError(f"Duplicate job '{name}'")
+        self.jobs[name] = Job(name, func, cron, events, max_concurrency, conflicts, emits, run_on_start)
+        return self.jobs[name]
+
+    def watch_file(self, path, event, interval=30.0):
+        """Fire `event` whenever path is created or modified (polled every `interval` seconds)"""
+        self.watches.append((path, event, interval))
+
+    # --- Triggers ---
+    def trigger(self, event):
+        """Fire an event; safe to call from any thread"""
+        if self._loop is None:
+            return
+        self._loop.call_soon_threadsafe(self._dispatch_event, event)
+
+    def _dispatch_event(self, event):
+        self.logger.info(f"Event {event}")
+        for job in self.jobs.values():
+            if event in job.events:
+                self.fire(job, reason=f"event {event}")
+
+    def fire(self, job, reason="manual"):
+        """
+        Start job now unless that would exceed its concurrency limit (the trigger is dropped)
+        or overlap a conflicting job (the trigger is deferred until the conflict finishes)
+        """
+        if job.running >= job.max_concurrency:
+            job.skipped += 1
+            JOB_SKIPPED.labels(job.name).inc()
+            self.logger.warning(f"Job {job.name} not started ({reason}): already running")
+            return False
+        busy = [name for name in job.conflicts if self.jobs.get(name) and self.jobs[name].running]
+        if busy:
+            if job.deferred is None:
+                job.deferred = reason
+                self.logger.info(f"Job {job.name} deferred ({reason}): waiting for {busy} to finish")
+            return False
+        job.deferred = None
+        job.running += 1
+        JOBS_RUNNING.labels(job.name).set(job.running)
+        task = self._loop.create_task(self._run(job, reason))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _run(self, job, reason):
+        started = datetime.now()
+        run_id = new_run_id()
+        if self.history is not None:
+            self.history.start_run(run_id, f"job:{job.name}", started)
+        with log_context(job=job.name, run_id=run_id):
+            self.logger.info(f"Job {job.name} started ({reason})")
+            ok = False
+            try:
+                if inspect.iscoroutinefunction(job.func):
+                    ok = await job.func() is not False
+                else:
+                    # Run in the executor under this job's log context
+                    context = contextvars.copy_context()
+                    ok = await self._loop.run_in_executor(self.executor, context.run, job.func) is not False
+            except Exception as e:
+                self.logger.error(f"Job {job.name} raised: {e}")
+            finally:
+                job.running -= 1
+                job.runs += 1
+                JOBS_RUNNING.labels(job.name).set(job.running)
+            finished = datetime.now()
+            elapsed = (finished - started).total_seconds()
+            status = 'succeeded' if ok else 'failed'
+            JOB_RUNS.labels(job.name, status).inc()
+            JOB_SECONDS.labels(job.name).observe(elapsed)
+            if self.history is not None:
+                self.history.finish_run(run_id, finished, elapsed, status)
+            log = self.logger.info if ok else self.logger.error
+            log(f"Job {job.name} {status} in {elapsed:.1f}s", extra={'duration': elapsed})
+        if ok and job.emits:
+            self._dispatch_event(job.emits)
+        self._fire_deferred()
+
+    def _fire_deferred(self):
+        """Start deferred jobs whose conflicting jobs have all finished"""
+        if self._stopping is not None and self._stopping.is_set():
+            return
+        for job in self.jobs.values():
+            if job.deferred is not None:
+                self.fire(job, reason=f"{job.deferred}, deferred")
+
+    # --- Loops ---
+    async def _cron_loop(self, job):
+        while not self._stopping.is_set():
+            next_run = job.cron.next_after(datetime.now())
+            self.logger.info(f"Job {job.name} next run at {next_run:%Y-%m-%d %H:%M}")
+            # Sleep until the exact fire time (or until the scheduler stops)
+            delay = max((next_run - datetime.now()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+                return
+            except asyncio.TimeoutError:
+                pass
+            # Guard against waking a hair early
+            while datetime.now() < next_run:
+                await asyncio.sleep((next_run - datetime.now()).total_seconds())
+            self.fire(job, reason=f"cron {job.cron.expression}")
+
+    async def _watch_loop(self, path, event, interval):
+        last = os.path.getmtime(path) if os.path.exists(path) else None
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            current = os.path.getmtime(path) if os.path.exists(path) else None
+            if current is not None and current != last:
+                self.logger.info(f"{path} changed")
+                self._dispatch_event(event)
+            last = current
+
+    async def run(self):
+        """Run until stop() (or SIGINT/SIGTERM), then wait for running jobs to finish"""
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                self._loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass  # e.g. Windows; KeyboardInterrupt still ends asyncio.run
+
+        loops = [self._cron_loop(job) for job in self.jobs.values() if job.cron]
+        loops += [self._watch_loop(*watch) for watch in self.watches]
+        for job in self.jobs.values():
+            if job.run_on_start:
+                self.fire(job, reason="startup")
+        await asyncio.gather(*loops, self._stopping.wait())
+
+        if self._tasks:
+            self.logger.info(f"Waiting for {len(self._tasks)} running job(s) to finish")
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.executor.shutdown(wait=True)
+
+    def stop(self):
+        if self._loop is not None and self._stopping is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    def describe(self):
+        """One line per job: triggers and limits"""
+        lines = []
+        for job in self.jobs.values():
+            triggers = ([f"cron '{job.cron.expression}'"] if job.cron else []) + \
+                       [f"event '{event}'" for event in sorted(job.events)]
+            lines.append(f"- {job.name}: {', '.join(triggers) or 'manual'}"
+                         f" (max {job.max_concurrency} concurrent"
+                         + (f", not alongside {sorted(job.conflicts)}" if job.conflicts else "") + ")")
+        return lines
@@ -0,0 +1,178 @@
+"""
+sms_channel.py
+Twilio SMS channel that holds one client over a pooled HTTP session and fans alerts
+out to many recipients concurrently under a rate limit. Includes a local fake Twilio
+HTTP server for offline load tests.
+"""
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from twilio.rest import Client
+from twilio.http.http_client import TwilioHttpClient
+from rate_limit import TokenBucket
+
+# Load environment variables
+load_dotenv()
+TWILIO_SID = os.getenv('TWILIO_SID')
+TWILIO_TOKEN = os.getenv('TWILIO_TOKEN')
+TWILIO_PHONE = os.getenv('TWILIO_PHONE')
+TWILIO_RATE = float(os.getenv('TWILIO_RATE', 10))  # messages per second
+
+TWILIO_API_BASE = "https://api.twilio.com"
+
+
+def format_sms(alert):
+    """SMS text for an alert"""
+    if alert.get('suppressed'):
+        # Rate-limit overflow summary from the dispatcher
+        metrics = sorted({a['metric'] for a in alert['suppressed']})
+        return (f"🚨 Climate Alert summary: {len(alert['suppressed'])} more alerts held back "
+                f"({', '.join(metrics)}). Highest severity: {alert['severity']}")
+    return f"🚨 Climate Alert: {alert['metric'].title()} is {alert['value']} (threshold: {alert['threshold']}). Severity: {alert['severity']}"
+
+
+class PooledTwilioHttpClient(TwilioHttpClient):
+    """TwilioHttpClient with a connection pool sized for concurrent senders and an optional base URL override"""
+
+    def __init__(self, pool_size=8, base_url=None, timeout=10):
+        super().__init__(pool_connections=True, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.base_url = base_url
+
+    def request(self, method, url, *args, **kwargs):
+        if self.base_url and url.startswith(TWILIO_API_BASE):
+            url = self.base_url.rstrip("/") + url[len(TWILIO_API_BASE):]
+        return super().request(method, url, *args, **kwargs)
+
+
+class SMSChannel:
+    """One Twilio client shared by a thread pool, rate limited across all sends"""
+
+    def __init__(self, sid=TWILIO_SID, token=TWILIO_TOKEN, from_phone=TWILIO_PHONE,
+                 max_workers=8, rate_per_second=TWILIO_RATE, burst=None, api_base_url=None):
+        self.from_phone = from_phone
+        self.http_client = PooledTwilioHttpClient(pool_size=max_workers, base_url=api_base_url)
+        self.client = Client(sid, token, http_client=self.http_client)
+        self.rate_limiter = TokenBucket(rate_per_second, burst)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="sms")
+
+    def send(self, alert, recipient_phone, body=None):
+        """Send one SMS, waiting for rate-limit capacity; raises on failure"""
+        self.rate_limiter.acquire()
+        return self.client.messages.create(
+            body=body or format_sms(alert),
+            from_=self.from_phone,
+            to=recipient_phone
+        )
+
+    def fan_out(self, alert, recipient_phones):
+        """Send one alert to many numbers concurrently; returns {phone: True or the exception}"""
+        body = format_sms(alert)
+        futures = {phone: self.executor.submit(self.send, alert, phone, body) for phone in recipient_phones}
+        results = {}
+        for phone, future in futures.items():
+            try:
+                future.result()
+                results[phone] = True
+            except Exception as e:
+                results[phone] = e
+        return results
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.http_client.session.close()
+
+
+_default_channel = None
+_default_channel_lock = threading.Lock()
+
+
+def get_sms_channel():
+    """Process-wide SMS channel shared by ClimateAlertSystem"""
+    global _default_channel
+    with _default_channel_lock:
+        if _default_channel is None:
+            _default_channel = SMSChannel()
+        return _default_channel
+
+
+# --- Local Twilio stand-in for load tests ---
+class _FakeTwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        self.server.message_count += 1
+        payload = json.dumps({
+            'sid': f"SM{self.server.message_count:032d}",
+            'status': 'queued',
+            'date_created': None,
+        }).encode()
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeTwilioServer:
+    """Accepts Messages.json POSTs on localhost and answers like Twilio's API"""
+
+    def __init__(self, port=0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _FakeTwilioHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.message_count = 0
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+    @property
+    def message_count(self):
+        return self.httpd.message_count
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def benchmark_fan_out(n_messages=10_000, rate_per_second=5_000, max_workers=16):
+    """Fan one alert out to n_messages numbers against the local fake Twilio server"""
+    from datetime import datetime
+
+    alert = {'metric': 'temperature', 'value': 42, 'threshold': 40, 'type': 'high',
+             'severity': 'HIGH', 'timestamp': datetime.now()}
+    phones = [f"+1555{i:07d}" for i in range(n_messages)]
+    with FakeTwilioServer() as server:
+        channel = SMSChannel('ACfake', 'token', '+15550000000', max_workers=max_workers,
+                             rate_per_second=rate_per_second, api_base_url=server.base_url)
+        start = time.perf_counter()
+        results = channel.fan_out(alert, phones)
+        elapsed = time.perf_counter() - start
+        channel.close()
+        failures = sum(result is not True for result in results.values())
+        print(f"Sent {n_messages - failures:,}/{n_messages:,} SMS in {elapsed:.2f}s "
+              f"({n_messages / elapsed:,.0f} msg/s, server received {server.message_count:,})")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark_fan_out(int(sys.argv[2]) if len(sys.argv) > 2 else 10_000)
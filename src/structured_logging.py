@@ -0,0 +1,142 @@
+"""
+structured_logging.py
+Non-blocking structured logging. Records are put on an in-memory queue (QueueHandler)
+and written by a QueueListener thread, so collection, training and alert code never
+waits on disk or console I/O. The log file gets one JSON object per line carrying the
+run ID, pipeline, job, stage, city and duration bound with log_context() or passed as
+`extra`; the console keeps a short human-readable format.
+"""
+import os
+import json
+import queue
+import atexit
+import logging
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_PATH = "logs/climate_pipeline.log"
+CONTEXT_FIELDS = ('run_id', 'pipeline', 'job', 'stage', 'city', 'duration')
+
+_context = contextvars.ContextVar('log_context', default={})
+_listener = None
+_queue_handler = None
+
+
+@contextmanager
+def log_context(**fields):
+    """Attach fields (run_id, stage, city, ...) to every record logged inside the block"""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the current log_context onto each record; explicit `extra` values win"""
+
+    def filter(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = round(value, 3) if field == 'duration' else value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class ConsoleFormatter(logging.Formatter):
+    """The previous plain format, prefixed with the stage or job and city when known"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s - %(levelname)s - %(message)s')
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        tags = [getattr(record, field, None) for field in ('stage', 'job', 'city')]
+        tags = [str(tag) for tag in tags if tag is not None]
+        return text.replace(' - ', f" - [{' '.join(tags)}] ", 1) if tags else text
+
+
+class _PreparedQueueHandler(QueueHandler):
+    """
+    Resolves the message and traceback in the calling thread (the listener must not
+    touch live arguments), but leaves formatting to the listener's handlers
+    """
+
+    def prepare(self, record):
+        record = logging.makeLogRecord(record.__dict__)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(log_path=LOG_PATH, level=logging.INFO, console=True):
+    """
+    Route the root logger through a queue to a JSON log file (and the console).
+    Safe to call more than once; only the first call installs the handlers.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return logging.getLogger()
+
+    handlers = []
+    if log_path:
+        directory = os.path.dirname(log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file_handler = logging.FileHandler(log_path)
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(ConsoleFormatter())
+        handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    _queue_handler = _PreparedQueueHandler(records)
+    _queue_handler.addFilter(ContextFilter())
+    root = logging.getLogger()
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return root
+
+
+def stop_logging():
+    """Write out every queued record and detach the handlers"""
+    global _listener, _queue_handler
+    if _listener is None:
+        return
+    _listener.stop()
+    logging.getLogger().removeHandler(_queue_handler)
+    for handler in _listener.handlers:
+        handler.close()
+    _listener = _queue_handler = None
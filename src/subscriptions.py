@@ -0,0 +1,263 @@
+"""
+subscriptions.py
+Subscriber store for multi-tenant alert fan-out. An inverted index maps
+(city, metric, severity) to subscriber sets, with '*' as a wildcard in any position,
+so each alert resolves its recipients in O(matches). Geofenced subscriptions
+(point-and-radius or polygon) are resolved to stations through a BallTree over
+station coordinates and folded into the same index.
+"""
+import os
+import json
+import time
+import itertools
+import threading
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+SUBSCRIPTIONS_PATH = "data/subscriptions.json"
+STATIONS_PATH = "data/stations.csv"
+WILDCARD = '*'
+EARTH_RADIUS_KM = 6371.0
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def _point_in_polygon(lat, lon, polygon):
+    """Ray-casting test; polygon is a list of [lat, lon] vertices"""
+    inside = False
+    n = len(polygon)
+    for i in range(n):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[i - 1]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < crossing:
+                inside = not inside
+    return inside
+
+
+class StationIndex:
+    """BallTree (haversine) over station coordinates for radius and polygon lookups"""
+
+    def __init__(self, stations):
+        self.stations = stations.reset_index(drop=True)
+        self.names = self.stations['city'].to_numpy()
+        self.coords = self.stations[['latitude', 'longitude']].to_numpy(dtype=float)
+        self.tree = BallTree(np.radians(self.coords), metric='haversine') if len(self.coords) else None
+
+    @classmethod
+    def load(cls, path=STATIONS_PATH):
+        if not os.path.exists(path):
+            return cls(pd.DataFrame(columns=['city', 'latitude', 'longitude']))
+        return cls(pd.read_csv(path))
+
+    def _query(self, lat, lon, radius_km):
+        if self.tree is None:
+            return np.array([], dtype=int)
+        return self.tree.query_radius(np.radians([[lat, lon]]), r=radius_km / EARTH_RADIUS_KM)[0]
+
+    def within_radius(self, lat, lon, radius_km):
+        """Station names within radius_km of a point"""
+        return list(self.names[self._query(lat, lon, radius_km)])
+
+    def within_polygon(self, polygon):
+        """Station names inside a polygon of [lat, lon] vertices"""
+        vertices = np.asarray(polygon, dtype=float)
+        center_lat, center_lon = vertices.mean(axis=0)
+        # Tree query on the circle enclosing the polygon, exact test on the candidates
+        radius = _haversine_km(center_lat, center_lon, vertices[:, 0], vertices[:, 1]).max()
+        candidates = self._query(center_lat, center_lon, radius + 1.0)
+        return [self.names[i] for i in candidates
+                if _point_in_polygon(self.coords[i, 0], self.coords[i, 1], polygon)]
+
+    def resolve(self, geofence):
+        if 'polygon' in geofence:
+            return self.within_polygon(geofence['polygon'])
+        lat, lon = geofence['point']
+        return self.within_radius(lat, lon, geofence['radius_km'])
+
+
+class SubscriptionStore:
+    """Subscribers and the (city, metric, severity) → subscriber-id inverted index"""
+
+    def __init__(self, stations=None):
+        self.subscribers = {}
+        self.index = {}
+        self.stations = stations
+        self._keys = {}
+
+    @classmethod
+    def load(cls, path=SUBSCRIPTIONS_PATH, stations_path=STATIONS_PATH):
+        """
+        Read subscribers from JSON: [{id, email, phone, watch: [{city, metric, severity}],
+        geofences: [{point: [lat, lon], radius_km} or {polygon: [[lat, lon], ...]}, with
+        optional metric/severity]}]
+        """
+        store = cls(StationIndex.load(stations_path))
+        if os.path.exists(path):
+            with open(path) as f:
+                for record in json.load(f):
+                    store.add(record['id'], record.get('watch', []),
+                              email=record.get('email'), phone=record.get('phone'),
+                              geofences=record.get('geofences'))
+        return store
+
+    def save(self, path=SUBSCRIPTIONS_PATH):
+        records = [{'id': sid, **subscriber} for sid, subscriber in self.subscribers.items()]
+        with open(path, "w") as f:
+            json.dump(records, f, indent=2)
+
+    @staticmethod
+    def _key(watch):
+        return (watch.get('city', WILDCARD), watch.get('metric', WILDCARD),
+                watch.get('severity', WILDCARD))
+
+    def _geofence_watch(self, geofence):
+        """Expand a geofence into per-station watch filters"""
+        if self.stations is None:
+            self.stations = StationIndex.load()
+        return [{'city': name, 'metric': geofence.get('metric', WILDCARD),
+                 'severity': geofence.get('severity', WILDCARD)}
+                for name in self.stations.resolve(geofence)]
+
+    def add(self, subscriber_id, watch, email=None, phone=None, geofences=None):
+        """Register (or replace) a subscriber watching {city, metric, severity} filters and/or geofences"""
+        if subscriber_id in self.subscribers:
+            self.remove(subscriber_id)
+        subscriber = {'email': email, 'phone': phone, 'watch': list(watch)}
+        if geofences:
+            subscriber['geofences'] = list(geofences)
+        self.subscribers[subscriber_id] = subscriber
+
+        expanded = list(watch)
+        for geofence in geofences or []:
+            expanded += self._geofence_watch(geofence)
+        keys = {self._key(item) for item in expanded}
+        self._keys[subscriber_id] = keys
+        for key in keys:
+            self.index.setdefault(key, set()).add(subscriber_id)
+
+    def add_geofence(self, subscriber_id, geofence, email=None, phone=None):
+        """Subscribe to every station inside a point-and-radius or polygon geofence"""
+        self.add(subscriber_id, [], email=email, phone=phone, geofences=[geofence])
+
+    def remove(self, subscriber_id):
+        if self.subscribers.pop(subscriber_id, None) is None:
+            return
+        for key in self._keys.pop(subscriber_id, ()):
+            members = self.index.get(key)
+            if members is not None:
+                members.discard(subscriber_id)
+                if not members:
+                    del self.index[key]
+
+    def set_stations(self, stations):
+        """Swap in a new station index and re-resolve every geofenced subscription"""
+        self.stations = stations
+        for subscriber_id, subscriber in list(self.subscribers.items()):
+            if subscriber.get('geofences'):
+                self.add(subscriber_id, subscriber['watch'], subscriber['email'],
+                         subscriber['phone'], subscriber['geofences'])
+
+    def match(self, alert):
+        """Ids of subscribers watching this alert's city, metric and severity"""
+        matched = set()
+        choices = ((alert.get('city'), WILDCARD), (alert['metric'], WILDCARD),
+                   (alert['severity'], WILDCARD))
+        for key in itertools.product(*choices):
+            members = self.index.get(key)
+            if members:
+                matched |= members
+        return matched
+
+    def recipients(self, alert):
+        """(emails, phones) for every subscriber matching the alert"""
+        emails, phones = [], []
+        for subscriber_id in self.match(alert):
+            subscriber = self.subscribers[subscriber_id]
+            if subscriber['email']:
+                emails.append(subscriber['email'])
+            if subscriber['phone']:
+                phones.append(subscriber['phone'])
+        return emails, phones
+
+
+_default_store = None
+_default_store_mtimes = None
+_default_store_lock = threading.Lock()
+
+
+def _mtime(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+def get_subscription_store(path=SUBSCRIPTIONS_PATH, stations_path=STATIONS_PATH):
+    """
+    Process-wide store shared by every alert check. The index and BallTree are rebuilt
+    only when the subscriptions or stations file changes on disk.
+    """
+    global _default_store, _default_store_mtimes
+    mtimes = (path, stations_path, _mtime(path), _mtime(stations_path))
+    with _default_store_lock:
+        if _default_store is None or mtimes != _default_store_mtimes:
+            _default_store = SubscriptionStore.load(path, stations_path)
+            _default_store_mtimes = mtimes
+        return _default_store
+
+
+def benchmark_subscriptions(n_subscriptions=100_000, n_alerts=10_000, seed=0):
+    """Index build time and per-alert resolve time for n_subscriptions random subscribers"""
+    import random
+
+    rng = random.Random(seed)
+    cities = ['Delhi', 'Mumbai', 'London', 'New York'] + [f"City{i}" for i in range(196)]
+    metrics = ['temperature', 'aqi', 'rainfall', 'humidity']
+    severities = ['HIGH', 'MEDIUM']
+
+    store = SubscriptionStore()
+    start = time.perf_counter()
+    for i in range(n_subscriptions):
+        watch = [{'city': rng.choice(cities),
+                  'metric': rng.choice(metrics + [WILDCARD]),
+                  'severity': rng.choice(severities + [WILDCARD])}
+                 for _ in range(rng.randint(1, 3))]
+        store.add(i, watch, email=f"user{i}@example.com", phone=f"+1555{i:07d}")
+    build = time.perf_counter() - start
+
+    alerts = [{'city': rng.choice(cities), 'metric': rng.choice(metrics),
+               'severity': rng.choice(severities)} for _ in range(n_alerts)]
+    start = time.perf_counter()
+    matched = sum(len(store.recipients(alert)[0]) for alert in alerts)
+    resolve = time.perf_counter() - start
+    print(f"Indexed {n_subscriptions:,} subscribers in {build:.2f}s; resolved {n_alerts:,} alerts "
+          f"in {resolve:.2f}s ({resolve / n_alerts * 1e6:,.0f} µs/alert, "
+          f"{matched / n_alerts:,.0f} recipients/alert)")
+
+
+def benchmark_geofences(n_stations=20_000, n_subscriptions=100_000, seed=0):
+    """Time resolving point-and-radius geofences against a large station set"""
+    rng = np.random.default_rng(seed)
+    stations = pd.DataFrame({
+        'city': [f"Station{i}" for i in range(n_stations)],
+        'latitude': rng.uniform(-60, 70, n_stations),
+        'longitude': rng.uniform(-180, 180, n_stations),
+    })
+    store = SubscriptionStore(StationIndex(stations))
+    points = stations.sample(n_subscriptions, replace=True, random_state=seed)
+    start = time.perf_counter()
+    for i, (lat, lon) in enumerate(points[['latitude', 'longitude']].to_numpy()):
+        store.add_geofence(i, {'point': [lat, lon], 'radius_km': 50}, email=f"user{i}@example.com")
+    elapsed = time.perf_counter() - start
+    print(f"Resolved {n_subscriptions:,} 50 km geofences over {n_stations:,} stations in {elapsed:.2f}s "
+          f"({elapsed / n_subscriptions * 1e6:,.0f} µs each)")
+
+
+if __name__ == "__main__":
+    benchmark_subscriptions()
+    benchmark_geofences()
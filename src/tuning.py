@@ -0,0 +1,192 @@
+"""
+tuning.py
+Parallel hyperparameter search for Prophet models with early pruning.
+Trial results are cached on disk so interrupted searches resume, and the best
+configuration per series is stored for the training pipeline.
+"""
+import os
+import json
+import math
+import hashlib
+import logging
+import itertools
+import argparse
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from sklearn.metrics import mean_absolute_error
+from modeling import train_prophet, prepare_series, DEFAULT_TRAINING_WINDOW, BEST_PARAMS_PATH
+from structured_logging import log_context, setup_logging
+
+TUNING_DIR = "data/tuning"
+
+PARAM_GRID = {
+    'changepoint_prior_scale': [0.001, 0.01, 0.05, 0.1, 0.5],
+    'seasonality_prior_scale': [0.1, 1.0, 10.0],
+    'seasonality_mode': ['additive', 'multiplicative'],
+}
+
+N_FOLDS = 3          # rolling-origin folds, one per pruning rung
+HORIZON_HOURS = 24   # length of each validation fold
+PRUNE_FACTOR = 1.5   # drop configs scoring worse than this multiple of the rung's best
+KEEP_FRACTION = 0.5  # fraction of configs promoted to the next rung
+
+logger = logging.getLogger(__name__)
+
+
+def param_combinations(grid=PARAM_GRID):
+    """Expand a parameter grid into a list of config dicts"""
+    keys = sorted(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def trial_key(params):
+    """Stable identifier for a parameter config"""
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def fold_cutoffs(series, n_folds=N_FOLDS, horizon_hours=HORIZON_HOURS):
+    """Training cutoffs for rolling-origin validation, most recent fold first"""
+    end = series['ds'].max()
+    return [end - pd.Timedelta(hours=horizon_hours * (i + 1)) for i in range(n_folds)]
+
+
+def _run_trial(series, target, city, params, cutoff, horizon_hours, window):
+    """Fit one config up to cutoff and score it on the following horizon (runs in a worker)"""
+    logging.getLogger('cmdstanpy').setLevel(logging.WARNING)
+    train = series[series['ds'] <= cutoff]
+    holdout = series[(series['ds'] > cutoff) &
+                     (series['ds'] <= cutoff + pd.Timedelta(hours=horizon_hours))]
+    if len(train) < 2 or holdout.empty:
+        return None
+    train_df = train.rename(columns={'ds': 'timestamp', 'y': target}).assign(city=city)
+    model = train_prophet(train_df, target, city, window=window, params=params)
+    forecast = model.predict(holdout[['ds']])
+    return float(mean_absolute_error(holdout['y'].values, forecast['yhat'].values))
+
+
+class TrialCache:
+    """On-disk record of finished trials for one series"""
+
+    def __init__(self, city, target, directory=TUNING_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{city}_{target}_trials.json")
+        self.trials = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.trials = json.load(f)
+
+    def get(self, params, cutoff):
+        entry = self.trials.get(trial_key(params))
+        if entry is None:
+            return None
+        return entry['folds'].get(cutoff.isoformat())
+
+    def has(self, params, cutoff):
+        entry = self.trials.get(trial_key(params))
+        return entry is not None and cutoff.isoformat() in entry['folds']
+
+    def put(self, params, cutoff, mae):
+        entry = self.trials.setdefault(trial_key(params), {'params': params, 'folds': {}})
+        entry['folds'][cutoff.isoformat()] = mae
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.trials, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _score(cache, params, cutoffs):
+    """Mean MAE over the given folds; failed folds count as infinitely bad"""
+    maes = [cache.get(params, cutoff) for cutoff in cutoffs]
+    if any(mae is None for mae in maes):
+        return math.inf
+    return sum(maes) / len(maes)
+
+
+def tune_series(df, target, city, executor, grid=PARAM_GRID, n_folds=N_FOLDS,
+                horizon_hours=HORIZON_HOURS, window=DEFAULT_TRAINING_WINDOW):
+    """Successive-halving search for one series; returns (best_params, best_mae)"""
+    series = prepare_series(df, target, city).sort_values('ds')
+    cutoffs = fold_cutoffs(series, n_folds, horizon_hours)
+    cache = TrialCache(city, target)
+    candidates = param_combinations(grid)
+
+    for rung, cutoff in enumerate(cutoffs):
+        pending = [p for p in candidates if not cache.has(p, cutoff)]
+        logger.info(f"{city} - {target}: rung {rung + 1}/{len(cutoffs)}, "
+                    f"{len(candidates)} configs ({len(candidates) - len(pending)} cached)")
+        futures = {
+            executor.submit(_run_trial, series, target, city, params, cutoff, horizon_hours, window): params
+            for params in pending
+        }
+        for future in as_completed(futures):
+            params = futures[future]
+            try:
+                mae = future.result()
+            except Exception as e:
+                logger.warning(f"Trial failed for {city} - {target} {params}: {e}")
+                mae = None
+            cache.put(params, cutoff, mae)
+
+        scored = sorted(((_score(cache, p, cutoffs[:rung + 1]), p) for p in candidates),
+                        key=lambda item: item[0])
+        best_score = scored[0][0]
+        if math.isinf(best_score):
+            logger.warning(f"No successful trials for {city} - {target}")
+            return None, None
+        survivors = [p for score, p in scored if score <= best_score * PRUNE_FACTOR]
+        keep = max(1, math.ceil(len(candidates) * KEEP_FRACTION))
+        candidates = survivors[:keep]
+
+    best_params = candidates[0]
+    return best_params, _score(cache, best_params, cutoffs)
+
+
+def save_best_params(results, path=BEST_PARAMS_PATH):
+    """Merge tuned configs into the best-params file read by modeling.load_best_params"""
+    best = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            best = json.load(f)
+    for (city, target), (params, mae) in results.items():
+        if params is not None:
+            best[f"{city}|{target}"] = {
+                'params': params,
+                'mae': mae,
+                'tuned_at': datetime.now().isoformat(timespec='seconds'),
+            }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(best, f, indent=2)
+    logger.info(f"Best parameters saved to {path}")
+
+
+def run_tuning(df, cities=None, metrics=None, workers=None):
+    """Tune every city/metric series on a shared process pool"""
+    cities = cities or list(df['city'].unique())
+    metrics = metrics or ['temperature', 'humidity', 'rainfall', 'aqi']
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for city in cities:
+            for metric in metrics:
+                with log_context(city=city):
+                    params, mae = tune_series(df, metric, city, executor)
+                    results[(city, metric)] = (params, mae)
+                    if params is not None:
+                        logger.info(f"{city} - {metric}: MAE {mae:.3f} with {params}")
+    save_best_params(results)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tune Prophet hyperparameters per series")
+    parser.add_argument("--data", default="data/combined_climate.csv")
+    parser.add_argument("--cities", nargs="*")
+    parser.add_argument("--metrics", nargs="*")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    setup_logging(log_path=None)
+    df = pd.read_csv(args.data)
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    run_tuning(df, args.cities, args.metrics, args.workers)
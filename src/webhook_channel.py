@@ -0,0 +1,384 @@
+"""
+webhook_channel.py
+Pushes climate alerts to an incident system over HTTP. Alerts are batched into JSON
+payloads and posted over a keep-alive connection pool; failed posts are retried with
+backoff under the same Idempotency-Key so the receiver can drop duplicates. Background
+batches that still fail are written to the dead-letter file. Includes a local HTTP
+stand-in for offline burst tests.
+"""
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from rate_limit import TokenBucket
+from dispatch_queue import DEAD_LETTER_PATH
+
+# Load environment variables
+load_dotenv()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_TOKEN = os.getenv('WEBHOOK_TOKEN')
+WEBHOOK_RATE = float(os.getenv('WEBHOOK_RATE', 10))  # batch posts per second; 0 = unlimited
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class WebhookError(Exception):
+    """A batch could not be delivered"""
+
+
+def alert_id(alert):
+    """Stable identifier for an alert, the same on every retry and every process"""
+    parts = [alert.get('city'), alert['metric'], alert['type'], alert.get('rule'),
+             str(alert['timestamp']), str(alert['value'])]
+    return hashlib.sha256("|".join(str(p) for p in parts).encode()).hexdigest()[:32]
+
+
+def alert_payload(alert):
+    """JSON-safe representation of one alert"""
+    timestamp = alert['timestamp']
+    return {
+        'id': alert_id(alert),
+        'city': alert.get('city'),
+        'metric': alert['metric'],
+        'value': float(alert['value']),
+        'threshold': None if alert['threshold'] is None else float(alert['threshold']),
+        'type': alert['type'],
+        'severity': alert['severity'],
+        'rule': alert.get('rule'),
+        'timestamp': timestamp.isoformat() if hasattr(timestamp, 'isoformat') else str(timestamp),
+    }
+
+
+def batch_payload(alerts):
+    """(idempotency key, JSON body) for a batch of alerts"""
+    items = [alert_payload(alert) for alert in alerts]
+    key = hashlib.sha256("".join(item['id'] for item in items).encode()).hexdigest()
+    body = json.dumps({'idempotency_key': key, 'sent_at': datetime.now().isoformat(),
+                       'alerts': items}, default=str)
+    return key, body
+
+
+class WebhookChannel:
+    """Batches alerts and posts them over a pooled keep-alive session with retries"""
+
+    def __init__(self, url=WEBHOOK_URL, token=WEBHOOK_TOKEN, pool_size=8, batch_size=100,
+                 batch_window=1.0, max_retries=3, backoff_base=0.5, backoff_max=10.0, timeout=10,
+                 rate_per_second=WEBHOOK_RATE, dead_letter_path=DEAD_LETTER_PATH):
+        self.url = url
+        self.dead_letter_path = dead_letter_path
+        self.rate_limiter = TokenBucket(rate_per_second) if rate_per_second else None
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers['Content-Type'] = 'application/json'
+        if token:
+            self.session.headers['Authorization'] = f"Bearer {token}"
+        self.executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="webhook")
+
+        self.stats = {'batches': 0, 'alerts': 0, 'retries': 0, 'failed': 0}
+        self._stats_lock = threading.Lock()
+        self._pending = []
+        self._pending_since = None
+        self._pending_lock = threading.Lock()
+        self._in_flight = set()
+        self._flusher = None
+        self._stopped = threading.Event()
+        self._dead_letter_lock = threading.Lock()
+
+    @property
+    def closed(self):
+        return self._stopped.is_set()
+
+    def _check_open(self):
+        if self.closed:
+            raise WebhookError("Webhook channel is closed")
+
+    # --- Delivery ---
+    def post_batch(self, alerts):
+        """Post alerts as one payload, retrying transient failures; raises WebhookError"""
+        self._check_open()
+        return self._post(alerts)
+
+    def _post(self, alerts):
+        if not alerts:
+            return None
+        key, body = batch_payload(alerts)
+        headers = {'Idempotency-Key': key}
+        for attempt in range(self.max_retries + 1):
+            delay = None
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            try:
+                response = self.session.post(self.url, data=body, headers=headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if response.status_code < 300:
+                    self._count(batches=1, alerts=len(alerts))
+                    return key
+                error = WebhookError(f"HTTP {response.status_code} from {self.url}")
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                retry_after = response.headers.get('Retry-After')
+                if retry_after and retry_after.isdigit():
+                    delay = min(float(retry_after), self.backoff_max)
+            if attempt == self.max_retries:
+                break
+            if delay is None:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+            self._count(retries=1)
+            time.sleep(delay)
+        self._count(failed=len(alerts))
+        raise WebhookError(f"Webhook delivery of {len(alerts)} alerts failed: {error}")
+
+    def send_alert(self, alert):
+        """Post a single alert immediately"""
+        return self.post_batch([alert])
+
+    # --- Batching ---
+    def queue_alert(self, alert):
+        """
+        Add an alert to the current batch; full or expired batches are posted in the
+        background. Raises WebhookError once the channel is closed.
+        """
+        self._check_open()
+        with self._pending_lock:
+            if not self._pending:
+                self._pending_since = time.monotonic()
+            self._pending.append(alert)
+            full = len(self._pending) >= self.batch_size
+            batch = self._take_pending() if full else None
+        if batch:
+            self._submit(batch)
+        else:
+            self._ensure_flusher()
+
+    def _take_pending(self):
+        batch, self._pending = self._pending, []
+        return batch
+
+    def _submit(self, batch):
+        future = self.executor.submit(self._post_queued, batch)
+        with self._pending_lock:
+            self._in_flight.add(future)
+        future.add_done_callback(self._finished)
+
+    def _post_queued(self, batch):
+        """Post a background batch; one that still fails after retries is dead-lettered"""
+        try:
+            return self._post(batch)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Webhook batch failed, dead-lettering {len(batch)} alerts: {e}")
+            self._dead_letter(batch, repr(e))
+            raise
+
+    def _finished(self, future):
+        with self._pending_lock:
+            self._in_flight.discard(future)
+
+    def _dead_letter(self, alerts, reason):
+        """Same record format as NotificationDispatcher's dead letters, one line per alert"""
+        failed_at = datetime.now().isoformat()
+        lines = [json.dumps({'failed_at': failed_at, 'channel': 'webhook', 'recipient': self.url,
+                             'attempts': self.max_retries + 1, 'reason': reason, 'alert': alert},
+                            default=str) + "\n" for alert in alerts]
+        with self._dead_letter_lock:
+            directory = os.path.dirname(self.dead_letter_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.dead_letter_path, "a") as f:
+                f.writelines(lines)
+
+    def flush(self, force=False):
+        """Post the pending batch if its window has elapsed (or now when force=True)"""
+        with self._pending_lock:
+            due = self._pending and (force or time.monotonic() - self._pending_since >= self.batch_window)
+            batch = self._take_pending() if due else None
+        if batch:
+            self._submit(batch)
+
+    def _ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        interval = max(self.batch_window / 4, 0.05)
+        while not self._stopped.wait(interval):
+            self.flush()
+
+    def drain(self):
+        """Post the pending batch now and wait for every in-flight post to finish"""
+        self.flush(force=True)
+        with self._pending_lock:
+            in_flight = list(self._in_flight)
+        for future in in_flight:
+            future.exception()
+
+    def close(self):
+        """
+        Post the pending batch, wait for in-flight posts and close the pool. The channel
+        refuses further alerts afterwards; get_webhook_channel() hands out a new one
+        once close_webhook_channel() has run.
+        """
+        if self.closed:
+            return
+        self.flush(force=True)
+        self._stopped.set()
+        self.executor.shutdown(wait=True)
+        self.session.close()
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self.stats[key] += delta
+
+
+_default_channel = None
+_default_channel_lock = threading.Lock()
+
+
+def get_webhook_channel():
+    """Process-wide webhook channel shared by ClimateAlertSystem"""
+    global _default_channel
+    with _default_channel_lock:
+        if _default_channel is None:
+            _default_channel = WebhookChannel()
+        return _default_channel
+
+
+def close_webhook_channel():
+    """At process exit: post pending batches and close the shared channel"""
+    global _default_channel
+    with _default_channel_lock:
+        channel, _default_channel = _default_channel, None
+    if channel is not None:
+        channel.close()
+
+
+# --- Local incident-system stand-in for load tests ---
+class _FakeIncidentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        key = self.headers.get('Idempotency-Key')
+        with server.lock:
+            server.requests += 1
+            failed = random.random() < server.failure_rate
+            if key in server.keys:
+                server.duplicates += 1
+                status, payload = 200, {'duplicate': True}
+            elif failed and random.random() < 0.5:
+                status, payload = 503, {'error': 'unavailable'}
+            else:
+                server.keys.add(key)
+                server.alert_ids.update(a['id'] for a in json.loads(body)['alerts'])
+                status, payload = 202, {'accepted': True}
+            if failed:
+                # Half the injected failures happen after the batch was stored
+                status, payload = 503, {'error': 'unavailable'}
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeIncidentServer:
+    """
+    Accepts webhook POSTs on localhost and dedupes them by Idempotency-Key. A fraction
+    of requests fail with 503, half of them after storing the batch, as when a response
+    is lost in transit.
+    """
+
+    def __init__(self, port=0, failure_rate=0.0):
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), _FakeIncidentHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.lock = threading.Lock()
+        self.httpd.failure_rate = failure_rate
+        self.httpd.requests = 0
+        self.httpd.duplicates = 0
+        self.httpd.keys = set()
+        self.httpd.alert_ids = set()
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/alerts"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def benchmark_burst(n_alerts=20_000, producers=8, batch_size=100, failure_rate=0.05):
+    """Burst n_alerts from several threads at once against the local stand-in"""
+    cities = ['Delhi', 'Mumbai', 'London', 'New York']
+    now = datetime.now()
+    alerts = [{'metric': 'aqi', 'value': 200 + i % 100, 'threshold': 200, 'type': 'high',
+               'severity': 'HIGH', 'city': cities[i % len(cities)], 'timestamp': now,
+               'rule': f"burst_{i}"} for i in range(n_alerts)]
+
+    with FakeIncidentServer(failure_rate=failure_rate) as server:
+        # Baseline: one new connection and one request per alert
+        sample = alerts[:min(n_alerts, 500)]
+        start = time.perf_counter()
+        for alert in sample:
+            key, body = batch_payload([alert])
+            requests.post(server.url, data=body, headers={'Idempotency-Key': key,
+                                                          'Content-Type': 'application/json'})
+        unpooled = len(sample) / (time.perf_counter() - start)
+
+        channel = WebhookChannel(server.url, batch_size=batch_size, batch_window=0.2,
+                                 backoff_base=0.05, max_retries=5, rate_per_second=None)
+        chunks = [alerts[i::producers] for i in range(producers)]
+        start = time.perf_counter()
+        threads = [threading.Thread(target=lambda chunk: [channel.queue_alert(a) for a in chunk],
+                                    args=(chunk,)) for chunk in chunks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        channel.close()
+        elapsed = time.perf_counter() - start
+
+        print(f"Unpooled, one alert per request: {unpooled:,.0f} alerts/s")
+        print(f"Pooled batches of {batch_size}: {n_alerts:,} alerts in {elapsed:.2f}s "
+              f"({n_alerts / elapsed:,.0f} alerts/s)")
+        print(f"Stats {channel.stats}; server saw {server.httpd.requests:,} requests, "
+              f"{len(server.httpd.alert_ids):,} distinct alerts, {server.httpd.duplicates} duplicates "
+              f"({failure_rate:.0%} injected 503s)")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+        benchmark_burst(int(sys.argv[2]) if len(sys.argv) > 2 else 20_000)